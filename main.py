@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 import sys
 
-from src.agent import Agent
-from src.config import load_config
-from src.cli import console
+USAGE = """usage: python main.py [query ...]
+       python main.py --batch FILE
+
+Without arguments, start the interactive REPL.
+With arguments, run them as a single query and exit.
+With --batch, answer every non-empty line of FILE in a single request."""
 
 
 def main(argv: list[str]) -> None:
+    if len(argv) == 2 and argv[1] in ("-h", "--help"):
+        print(USAGE)
+        return
+    if len(argv) > 1 and argv[1] == "--batch" and len(argv) != 3:
+        print("error: --batch requires exactly one FILE argument\n", file=sys.stderr)
+        print(USAGE, file=sys.stderr)
+        raise SystemExit(2)
+
+    # 延迟导入：--help 无需加载 openai/rich 等依赖
+    from src.agent import Agent
+    from src.cli import console
+    from src.config import load_config
+
     config = load_config(console)
     agent = Agent(config)
     try:
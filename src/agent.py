@@ -1,24 +1,94 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+import functools
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 import tiktoken
 from openai import OpenAI
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 
 from .config import Config
 from .cli import (
     console,
+    confirm_batch_execution,
     confirm_execution,
+    end_agent_response,
+    print_agent_delta,
     print_agent_response,
+    render_batch_answers,
     render_single_query_panel,
     render_startup_panel,
     setup_readline,
     show_token_stats,
 )
+from . import json_utils
+from .llm_cache import LLMCache
 from .message_manager import MessageManager
 from .tool_handler import ToolHandler
-from .mcp_client import MCPClientManager
+from .shell import shutdown_shells
 from .logger import StructuredLogger, get_logger
 
+if TYPE_CHECKING:
+    from .mcp_client import MCPClientManager
+
+
+BATCH_PROMPT = (
+    "请依次回答以下 {count} 个问题。回答完成后，最终回复只输出一个 JSON 字符串数组，"
+    "第 i 个元素是第 i 个问题的回答，不要输出其他内容：\n\n{questions}"
+)
+
+
+def parse_batch_answers(content: str, count: int) -> Optional[List[str]]:
+    """从模型回复中取出 JSON 数组形式的批量回答，格式不符时返回 None。"""
+    start, end = content.find("["), content.rfind("]")
+    if start < 0 or end < start:
+        return None
+    try:
+        answers = json_utils.loads(content[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(answers, list) or len(answers) != count:
+        return None
+    return [answer if isinstance(answer, str) else json_utils.dumps(answer) for answer in answers]
+
+
+# tiktoken 不认识的新模型名按系列推断编码，这些系列使用 o200k_base
+O200K_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-4.5", "gpt-5", "chatgpt-4o", "o1", "o3", "o4")
+
+
+# 推理模型系列不接受 max_tokens，输出上限必须通过 max_completion_tokens 传递
+MAX_COMPLETION_TOKENS_MODEL_PREFIXES = ("o1", "o3", "o4", "gpt-5")
+
+TRUNCATED_REPLY_NOTICE = (
+    "[系统提示] 上一条回复达到了输出 token 上限被截断{detail}。"
+    "请缩短回复，或把大段内容拆成多次较小的工具调用。"
+)
+
+
+def output_limit_kwargs(model: str, limit: Optional[int]) -> Dict[str, int]:
+    """按模型系列返回输出上限参数；未配置上限时不传。"""
+    if limit is None:
+        return {}
+    name = model.rsplit("/", 1)[-1]
+    if name.startswith(MAX_COMPLETION_TOKENS_MODEL_PREFIXES):
+        return {"max_completion_tokens": limit}
+    return {"max_tokens": limit}
+
+
+@functools.lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    # 同一进程内多次创建 Agent 时共用同一个编码对象
+    # OpenAI 兼容网关常用 "openai/gpt-4o" 形式的模型名，只看最后一段
+    name = model.rsplit("/", 1)[-1]
+    try:
+        return tiktoken.encoding_for_model(name)
+    except KeyError:
+        if name.startswith(O200K_MODEL_PREFIXES):
+            return tiktoken.get_encoding("o200k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
 
 class Agent:
     """Main orchestrator for the Bash Agent runtime."""
@@ -26,7 +96,7 @@ class Agent:
     def __init__(self, config: Config) -> None:
         self.config = config
         self.console = console
-        self.client = OpenAI()
+        self.client = OpenAI(timeout=config.request_timeout_s, max_retries=config.max_retries)
 
         # 初始化日志系统
         StructuredLogger.setup(config.log_file)
@@ -35,7 +105,11 @@ class Agent:
         self.logger.info(f"工作目录: {config.work_dir}")
         self.logger.info(f"日志文件: {config.log_file}")
 
-        self.encoding = self._load_encoding(config.openai_model)
+        # 编码表加载（首次可能需要下载）与 MCP 服务器连接互不依赖，放到后台线程同时进行
+        encoding_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tiktoken")
+        encoding_future = encoding_loader.submit(_get_encoding, config.openai_model)
+        encoding_loader.shutdown(wait=False)
+
         self.token_stats: Dict[str, Any] = {
             "prompt_tokens": 0,
             "completion_tokens": 0,
@@ -44,7 +118,11 @@ class Agent:
             "compressions": 0,
         }
 
+        self.llm_cache = LLMCache(config.log_file.parent / "llm_cache", config.llm_cache_ttl_s)
+        # 批量模式下回复由 render_batch_answers 统一渲染，不再流式回显
+        self.echo_responses = True
         self.mcp_manager = self._init_mcp_manager()
+        self.encoding = encoding_future.result()
         self.message_manager = MessageManager(
             config,
             self.console,
@@ -57,22 +135,20 @@ class Agent:
             self.console,
             lambda cmd: confirm_execution(config, cmd),
             self.mcp_manager,
+            confirm_many=lambda cmds: confirm_batch_execution(config, cmds),
         )
 
         self.messages: List[Dict[str, Any]] = []
         self._reset_conversation()
 
-    def _load_encoding(self, model: str):
-        try:
-            return tiktoken.encoding_for_model(model)
-        except KeyError:
-            return tiktoken.get_encoding("cl100k_base")
-
     def _init_mcp_manager(self) -> Optional[MCPClientManager]:
         if not self.config.mcp_config_path.exists():
             self.logger.info("MCP 配置文件不存在，跳过 MCP 连接")
             return None
 
+        # mcp SDK 导入较慢，只在存在配置文件时才加载
+        from .mcp_client import MCPClientManager
+
         manager = MCPClientManager()
         try:
             if manager.connect_from_config_file(str(self.config.mcp_config_path)):
@@ -89,11 +165,11 @@ class Agent:
     def _reset_conversation(self) -> None:
         self.messages = [self.message_manager.load_system()]
 
-    def _update_token_stats(self, response) -> None:
-        if response.usage:
-            self.token_stats["prompt_tokens"] += response.usage.prompt_tokens
-            self.token_stats["completion_tokens"] += response.usage.completion_tokens
-            self.token_stats["total_tokens"] += response.usage.total_tokens
+    def _update_token_stats(self, usage) -> None:
+        if usage:
+            self.token_stats["prompt_tokens"] += usage.prompt_tokens
+            self.token_stats["completion_tokens"] += usage.completion_tokens
+            self.token_stats["total_tokens"] += usage.total_tokens
             self.token_stats["api_calls"] += 1
 
     def show_token_stats(self) -> None:
@@ -157,52 +233,191 @@ class Agent:
         status = f"已连接 ({len(servers_info)} 个服务器)"
         return status, details
 
-    def _call_model(self):
-        self.logger.debug(f"调用 OpenAI API，模型: {self.config.openai_model}")
-        response = self.client.chat.completions.create(
+    def _call_model(self) -> Tuple[str, List[ChatCompletionMessageToolCall], List[Dict[str, Any]], bool]:
+        self.logger.debug("调用 OpenAI API，模型: %s", self.config.openai_model)
+        tools = self.tool_handler.get_tools()
+        temperature = float(self.config.model_temperature)
+        cache_key = self.llm_cache.make_key(
+            self.config.openai_model,
+            self._cache_key_messages(),
+            tools,
+            temperature,
+            self.config.max_output_tokens,
+        )
+        if cache_key is not None:
+            cached = self.llm_cache.get(cache_key)
+            if cached is not None:
+                self.logger.info("模型响应命中缓存，跳过 API 调用")
+                return self._replay_cached_response(cached)
+
+        stream = self.client.chat.completions.create(
             model=self.config.openai_model,
             messages=self.messages,
-            tools=self.tool_handler.get_tools(),
+            tools=tools,
             tool_choice="auto",
-            temperature=float(self.config.model_temperature),
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **output_limit_kwargs(self.config.openai_model, self.config.max_output_tokens),
         )
-        self._update_token_stats(response)
-        self.logger.debug(f"API 调用完成，使用 tokens: {response.usage.total_tokens if response.usage else 0}")
-        return response
+        content, tool_calls, serialized, truncated = self._consume_stream(stream)
+        # 被截断的回复不完整，不能缓存后重放；含工具调用的回复重放会再次执行命令，也不缓存
+        if cache_key is not None and not truncated and not tool_calls:
+            self.llm_cache.set(cache_key, {"content": content, "tool_calls": serialized})
+        return content, tool_calls, serialized, truncated
+
+    def _cache_key_messages(self) -> List[Dict[str, Any]]:
+        # 系统提示里的 ${NOW_ISO} 每次都不同，缓存键改用未填入时间的模板，否则永远无法命中
+        if self.messages and self.messages[0].get("role") == "system":
+            system = {"role": "system", "content": self.message_manager.load_system_template()}
+            return [system] + self.messages[1:]
+        return self.messages
+
+    def _replay_cached_response(
+        self,
+        cached: Dict[str, Any],
+    ) -> Tuple[str, List[ChatCompletionMessageToolCall], List[Dict[str, Any]], bool]:
+        content = cached.get("content") or ""
+        if content and self.echo_responses:
+            print_agent_response(content)
+        serialized = [
+            {"id": call["id"], "type": "function", "function": dict(call["function"])}
+            for call in cached.get("tool_calls", [])
+        ]
+        tool_calls = [
+            ChatCompletionMessageToolCall.model_construct(
+                id=call["id"],
+                type="function",
+                function=Function.model_construct(**call["function"]),
+            )
+            for call in serialized
+        ]
+        return content, tool_calls, serialized, False
+
+    def _consume_stream(
+        self,
+        stream,
+    ) -> Tuple[str, List[ChatCompletionMessageToolCall], List[Dict[str, Any]], bool]:
+        """边接收边输出文本内容，并按 index 拼接流式返回的 tool_calls。
+
+        返回 (content, tool_calls, serialized, truncated)：tool_calls 供 ToolHandler 分发，
+        serialized 是拼接时直接构建好的 assistant 消息格式，无需再序列化一遍；
+        truncated 表示回复因达到输出 token 上限（finish_reason == "length"）被截断。
+        """
+        content_parts: List[str] = []
+        pending_calls: Dict[int, Dict[str, Any]] = {}
+        pending_arguments: Dict[int, List[str]] = {}
+        usage = None
+        finish_reason = None
+
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if getattr(choice, "finish_reason", None):
+                finish_reason = choice.finish_reason
+            delta = choice.delta
+
+            if delta.content:
+                if self.echo_responses:
+                    if not content_parts:
+                        print_agent_delta(None)
+                    print_agent_delta(delta.content)
+                content_parts.append(delta.content)
+
+            for tc in delta.tool_calls or []:
+                entry = pending_calls.get(tc.index)
+                if entry is None:
+                    entry = pending_calls[tc.index] = {
+                        "id": "",
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    }
+                    pending_arguments[tc.index] = []
+                if tc.id:
+                    entry["id"] = tc.id
+                if tc.function:
+                    if tc.function.name:
+                        entry["function"]["name"] += tc.function.name
+                    if tc.function.arguments:
+                        pending_arguments[tc.index].append(tc.function.arguments)
+
+        if content_parts and self.echo_responses:
+            end_agent_response()
+
+        self._update_token_stats(usage)
+        self.logger.debug("API 调用完成，使用 tokens: %s", usage.total_tokens if usage else 0)
+
+        serialized: List[Dict[str, Any]] = []
+        tool_calls: List[ChatCompletionMessageToolCall] = []
+        for index in sorted(pending_calls):
+            entry = pending_calls[index]
+            function = entry["function"]
+            function["arguments"] = "".join(pending_arguments[index]) or "{}"
+            serialized.append(entry)
+            tool_calls.append(
+                ChatCompletionMessageToolCall.model_construct(
+                    id=entry["id"],
+                    type="function",
+                    function=Function.model_construct(name=function["name"], arguments=function["arguments"]),
+                )
+            )
+        return "".join(content_parts), tool_calls, serialized, finish_reason == "length"
 
-    def _handle_user_turn(self, user_input: str) -> None:
+    def _handle_user_turn(self, user_input: str) -> str:
+        """处理一轮用户输入，返回模型最终的文本回复。"""
         self.logger.info(f"用户输入: {user_input[:100]}{'...' if len(user_input) > 100 else ''}")
         self.messages.append({"role": "user", "content": user_input})
 
         while True:
             self.messages = self.message_manager.compress_if_needed(self.messages)
-            response = self._call_model()
-            message = response.choices[0].message
-            tool_calls = message.tool_calls or []
+            content, tool_calls, serialized_tool_calls, truncated = self._call_model()
+
+            if truncated:
+                return self._handle_truncated_reply(content, tool_calls)
 
             if not tool_calls:
-                self.logger.info(f"Agent 响应（无工具调用）: {(message.content or '')[:100]}{'...' if len(message.content or '') > 100 else ''}")
-                print_agent_response(message.content or "")
-                break
+                self.logger.info(f"Agent 响应（无工具调用）: {content[:100]}{'...' if len(content) > 100 else ''}")
+                if not content and self.echo_responses:
+                    print_agent_response("")
+                return content
 
             self.logger.info(f"Agent 请求调用 {len(tool_calls)} 个工具")
             self.messages.append(
                 {
                     "role": "assistant",
-                    "content": message.content or "",
-                    "tool_calls": self.message_manager.serialize_tool_calls(tool_calls),
+                    "content": content,
+                    "tool_calls": serialized_tool_calls,
                 }
             )
 
             self.tool_handler.handle_tool_calls(self.messages, tool_calls)
 
+    def _handle_truncated_reply(self, content: str, tool_calls: List[ChatCompletionMessageToolCall]) -> str:
+        """回复被输出上限截断：工具参数可能不完整，不执行，并把情况告诉用户和模型。"""
+        self.logger.warning(f"模型回复达到输出 token 上限被截断，丢弃 {len(tool_calls)} 个工具调用")
+        detail = f"，其中 {len(tool_calls)} 个工具调用的参数不完整，未执行" if tool_calls else ""
+        self.console.print(
+            f"[bold yellow]⚠️  回复达到输出 token 上限（MAX_OUTPUT_TOKENS）被截断{detail}[/bold yellow]"
+        )
+        self.messages.append({"role": "assistant", "content": content})
+        self.messages.append({"role": "user", "content": TRUNCATED_REPLY_NOTICE.format(detail=detail)})
+        return content
+
     def run(self, argv: List[str]) -> None:
         """Entry point used by main.py."""
-        setup_readline()
+        setup_readline(self.config.log_file.parent / "history")
 
         mcp_status, mcp_details = self._collect_mcp_info()
         render_startup_panel(self.config, mcp_status, mcp_details)
 
+        if len(argv) == 3 and argv[1] == "--batch":
+            self._run_batch(pathlib.Path(argv[2]))
+            self.show_token_stats()
+            return
+
         if len(argv) > 1:
             user_query = " ".join(argv[1:])
             render_single_query_panel(user_query)
@@ -212,6 +427,34 @@ class Agent:
 
         self._repl_loop()
 
+    def _run_batch(self, path: pathlib.Path) -> None:
+        """把文件中每行一个问题合并为一次对话请求，省去逐个提问的往返开销。"""
+        try:
+            questions = [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+        except OSError as exc:
+            self.console.print(f"[bold red]❌ 无法读取批量问题文件: {exc}[/bold red]")
+            return
+        if not questions:
+            self.console.print("[bold yellow]⚠️  批量问题文件为空[/bold yellow]")
+            return
+
+        self.logger.info(f"批量模式: {len(questions)} 个问题, 文件: {path}")
+        render_single_query_panel(f"批量处理 {len(questions)} 个问题（{path}）")
+        numbered = "\n".join(f"{index}. {question}" for index, question in enumerate(questions, 1))
+        self.echo_responses = False
+        try:
+            content = self._handle_user_turn(BATCH_PROMPT.format(count=len(questions), questions=numbered))
+        finally:
+            self.echo_responses = True
+
+        answers = parse_batch_answers(content, len(questions))
+        if answers is None:
+            self.logger.warning("批量模式: 模型回复不是预期的 JSON 数组")
+            self.console.print("[bold yellow]⚠️  模型回复不是预期的 JSON 数组，已按原样输出[/bold yellow]")
+            print_agent_response(content)
+            return
+        render_batch_answers(questions, answers)
+
     def _repl_loop(self) -> None:
         self.logger.info("进入交互式 REPL 模式")
         while True:
@@ -223,18 +466,23 @@ class Agent:
                 self.show_token_stats()
                 break
 
-            if user_input.lower() in ("/exit", "quit"):
+            # 空输入直接忽略，不发起模型请求
+            if not user_input:
+                continue
+
+            command = user_input.lower()
+            if command in ("/exit", "quit"):
                 self.logger.info("用户执行退出命令")
                 self.console.print("[bold yellow]👋 再见![/bold yellow]")
                 self.show_token_stats()
                 break
 
-            if user_input.lower() == "/help":
+            if command == "/help":
                 self.logger.debug("用户查看帮助信息")
                 self._show_help()
                 continue
 
-            if user_input.lower() == "/clear":
+            if command == "/clear":
                 self.logger.info("用户执行清空对话命令")
                 self.show_token_stats()
                 self._reset_conversation()
@@ -242,12 +490,12 @@ class Agent:
                 self.console.print("[bold green]✨ 对话历史已清空，Token 统计已重置[/bold green]")
                 continue
 
-            if user_input.lower() == "/stats":
+            if command == "/stats":
                 self.logger.debug("用户查看统计信息")
                 self.show_token_stats()
                 continue
 
-            if user_input.lower() == "/compress":
+            if command == "/compress":
                 self.logger.info("用户手动触发消息压缩")
                 if len(self.messages) <= 1:
                     self.console.print("[bold yellow]⚠️  消息历史为空，无需压缩[/bold yellow]")
@@ -265,4 +513,5 @@ class Agent:
                 self.logger.info("MCP 连接已清理")
             except Exception as e:
                 self.logger.error(f"清理 MCP 连接时出错: {e}")
+        shutdown_shells()
         self.logger.info("Bash Agent 正常关闭")
@@ -1,38 +1,98 @@
 from __future__ import annotations
 
-import readline
+import atexit
+import functools
+import pathlib
+import sys
 from typing import Any, Dict, List, Optional
 
 from rich.console import Console
+from rich.markup import escape
 from rich.panel import Panel
 from rich.prompt import Prompt
-from rich.syntax import Syntax
+from rich.text import Text
 
 from .config import Config
 from .message_manager import MessageManager
 
 console = Console()
 
+HISTORY_LENGTH = 1000
+
+
+def setup_readline(history_file: Optional[pathlib.Path] = None) -> None:
+    """Enable readline shortcuts (Ctrl+L to clear) and persistent input history."""
+    # 非交互输入（管道/脚本）用不到行编辑，也就不必加载 readline
+    if not sys.stdin.isatty():
+        return
+
+    import readline
 
-def setup_readline() -> None:
-    """Enable readline shortcuts (currently Ctrl+L to clear)."""
     try:
         readline.parse_and_bind(r'"\C-l": clear-screen')
+        readline.parse_and_bind("set enable-bracketed-paste on")
     except Exception: # windows use pyreadline
         import pyreadline
         pyreadline.parse_and_bind(r'"\C-l": clear-screen')
+        return
+
+    if history_file is None:
+        return
+    readline.set_history_length(HISTORY_LENGTH)
+    try:
+        readline.read_history_file(history_file)
+    except OSError:
+        pass
+    atexit.register(_save_history, history_file)
+
+
+def _save_history(history_file: pathlib.Path) -> None:
+    import readline
+
+    try:
+        readline.write_history_file(history_file)
+    except OSError:
+        pass
+
+
+@functools.lru_cache(maxsize=1)
+def _command_highlighting() -> tuple[Any, Any]:
+    """Build the bash lexer and monokai theme once instead of per confirmation."""
+    from pygments.lexers import get_lexer_by_name
+    from rich.syntax import Syntax
+
+    return get_lexer_by_name("bash"), Syntax.get_theme("monokai")
+
 
 def confirm_execution(config: Config, command: str) -> bool:
     if not config.confirm_before_exec:
         return True
+    return _ask_confirmation(command, "即将执行命令")
 
-    console.print(
-        Panel(
-            Syntax(command, "bash", theme="monokai", line_numbers=False),
-            title="[bold yellow]⚠️  即将执行命令[/bold yellow]",
-            border_style="yellow",
+
+def confirm_batch_execution(config: Config, commands: List[str]) -> bool:
+    """一次性确认一批并行执行的命令，全部执行或全部取消。"""
+    if not config.confirm_before_exec:
+        return True
+    return _ask_confirmation("\n".join(commands), f"即将并行执行 {len(commands)} 条命令")
+
+
+def _ask_confirmation(command: str, title: str) -> bool:
+    if console.is_terminal:
+        from rich.syntax import Syntax  # pulls in pygments, only needed when confirming
+
+        lexer, theme = _command_highlighting()
+        console.print(
+            Panel(
+                Syntax(command, lexer, theme=theme, line_numbers=False),
+                title=f"[bold yellow]⚠️  {title}[/bold yellow]",
+                border_style="yellow",
+            )
         )
-    )
+    else:
+        # 非终端输出（管道/CI）无需高亮渲染
+        console.print(f"⚠️  {title}:", markup=False)
+        console.out(command, highlight=False)
 
     try:
         answer = Prompt.ask("是否继续执行", choices=["y", "yes", "n", "no"], default="n").lower()
@@ -126,5 +186,29 @@ def render_single_query_panel(user_query: str) -> None:
     )
 
 
+def render_batch_answers(questions: List[str], answers: List[str]) -> None:
+    for index, (question, answer) in enumerate(zip(questions, answers), 1):
+        console.print(
+            Panel(
+                Text(answer),
+                title=f"[bold blue]{index}. {escape(question)}[/bold blue]",
+                title_align="left",
+                border_style="green",
+            )
+        )
+
+
 def print_agent_response(content: Optional[str]) -> None:
     console.print(f"[bold green]🤖 Agent:[/bold green] {content or ''}")
+
+
+def print_agent_delta(delta: Optional[str]) -> None:
+    """Print a streamed content delta; ``None`` prints the response header."""
+    if delta is None:
+        console.print("[bold green]🤖 Agent:[/bold green] ", end="")
+        return
+    console.out(delta, end="", highlight=False)
+
+
+def end_agent_response() -> None:
+    console.print()
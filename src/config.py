@@ -4,7 +4,7 @@ import os
 import pathlib
 import platform
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Optional, Tuple
 
 from dotenv import load_dotenv
 from rich.console import Console
@@ -24,6 +24,10 @@ class Config:
     shell_type: str
     project_root: pathlib.Path
     log_file: pathlib.Path
+    max_output_tokens: Optional[int] = None
+    request_timeout_s: float = 60.0
+    max_retries: int = 2
+    llm_cache_ttl_s: float = 0.0
 
 
 def _get_os_info() -> Tuple[str, str]:
@@ -54,6 +58,12 @@ def load_config(console: Console) -> Config:
     mcp_config_path = pathlib.Path(os.getenv("MCP_CONFIG_PATH", "./mcp_config.json")).resolve()
     max_context_tokens = int(os.getenv("MAX_CONTEXT_TOKENS", "100000"))
     keep_recent_messages = int(os.getenv("KEEP_RECENT_MESSAGES", "10"))
+    # 未设置时不限制输出长度，由模型/服务端默认值决定
+    raw_max_output_tokens = os.getenv("MAX_OUTPUT_TOKENS")
+    max_output_tokens = int(raw_max_output_tokens) if raw_max_output_tokens else None
+    request_timeout_s = float(os.getenv("REQUEST_TIMEOUT_S", "60"))
+    max_retries = int(os.getenv("MAX_RETRIES", "2"))
+    llm_cache_ttl_s = float(os.getenv("LLM_CACHE_TTL_S", "0"))
 
     work_dir.mkdir(parents=True, exist_ok=True)
 
@@ -77,4 +87,8 @@ def load_config(console: Console) -> Config:
         shell_type=shell_type,
         project_root=project_root,
         log_file=log_file,
+        max_output_tokens=max_output_tokens,
+        request_timeout_s=request_timeout_s,
+        max_retries=max_retries,
+        llm_cache_ttl_s=llm_cache_ttl_s,
     )
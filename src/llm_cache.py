@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from . import json_utils
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# 温度高于此值时输出本身就不稳定，缓存没有意义
+MAX_CACHEABLE_TEMPERATURE = 0.3
+
+
+class LLMCache:
+    """模型响应缓存：进程内 LRU + 磁盘文件，按 TTL 过期。
+
+    键是 (model, messages, tools, temperature, max_tokens) 的 sha256。历史中包含工具的真实输出，
+    所以只有在环境状态与上次完全一致时才会命中。
+    """
+
+    def __init__(self, cache_dir: pathlib.Path, ttl_s: float, max_entries: int = 256) -> None:
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_s > 0
+
+    def make_key(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        tools: List[Dict[str, Any]],
+        temperature: float,
+        max_tokens: Optional[int],
+    ) -> Optional[str]:
+        if not self.enabled or temperature > MAX_CACHEABLE_TEMPERATURE:
+            return None
+        request = {
+            "model": model,
+            "messages": messages,
+            "tools": tools,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            entry = self._read_disk(key)
+            if entry is None:
+                return None
+            self._remember(key, entry)
+
+        if entry["expires_at"] < time.time():
+            self._forget(key)
+            return None
+        return entry["response"]
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        entry = {"expires_at": time.time() + self.ttl_s, "response": response}
+        self._remember(key, entry)
+        # 过期文件只有再次查询同一个键时才会删除，每个进程首次写入时顺带清理一遍
+        if not self._pruned:
+            self._pruned = True
+            self.prune_expired()
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            (self.cache_dir / f"{key}.json").write_text(json_utils.dumps(entry), encoding="utf-8")
+        except OSError as exc:
+            logger.warning(f"写入模型响应缓存失败: {exc}")
+
+    def prune_expired(self) -> int:
+        """删除写入时间早于 TTL 的缓存文件，返回删除的数量；按文件 mtime 判断，无需逐个解析。"""
+        cutoff = time.time() - self.ttl_s
+        removed = 0
+        try:
+            paths = list(self.cache_dir.glob("*.json"))
+        except OSError:
+            return 0
+        for path in paths:
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"清理了 {removed} 个过期的模型响应缓存文件")
+        return removed
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        try:
+            (self.cache_dir / f"{key}.json").unlink()
+        except OSError:
+            pass
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.cache_dir / f"{key}.json"
+        try:
+            return json_utils.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.warning(f"读取模型响应缓存失败: {exc}")
+            return None
@@ -1,15 +1,36 @@
 from __future__ import annotations
 
+import atexit
 import logging
+import queue
 import sys
 from pathlib import Path
 from typing import Optional
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+# 每写入这么多条记录才检查一次是否需要轮转，省去每条日志的 seek/tell
+ROLLOVER_CHECK_INTERVAL = 256
+
+
+class _RotatingFileHandler(RotatingFileHandler):
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._records_since_check = 0
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        self._records_since_check += 1
+        if self._records_since_check < ROLLOVER_CHECK_INTERVAL:
+            return False
+        self._records_since_check = 0
+        return bool(super().shouldRollover(record))
 
 
 class StructuredLogger:
 
     _instances: dict[str, logging.Logger] = {}
+    _listener: Optional[QueueListener] = None
 
     @classmethod
     def setup(
@@ -26,11 +47,12 @@ class StructuredLogger:
             datefmt='%Y-%m-%d %H:%M:%S'
         )
 
-        file_handler = RotatingFileHandler(
+        file_handler = _RotatingFileHandler(
             log_file,
             maxBytes=max_bytes,
             backupCount=backup_count,
             encoding='utf-8',
+            delay=True,
         )
         file_handler.setLevel(level)
         file_handler.setFormatter(detailed_formatter)
@@ -40,7 +62,12 @@ class StructuredLogger:
 
         root_logger.handlers.clear()
 
-        root_logger.addHandler(file_handler)
+        # 调用线程只负责入队，格式化和写文件在后台线程完成
+        cls.shutdown()
+        log_queue: queue.Queue = queue.Queue(-1)
+        cls._listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        cls._listener.start()
+        root_logger.addHandler(QueueHandler(log_queue))
 
         # 禁用第三方库的调试日志，避免干扰
         logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -48,6 +75,15 @@ class StructuredLogger:
         logging.getLogger("openai").setLevel(logging.WARNING)
         logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+    @classmethod
+    def shutdown(cls) -> None:
+        """停止后台写日志线程，并写完队列中剩余的记录"""
+        if cls._listener is not None:
+            cls._listener.stop()
+            for handler in cls._listener.handlers:
+                handler.close()
+            cls._listener = None
+
     @classmethod
     def get_logger(cls, name: str) -> logging.Logger:
         if name not in cls._instances:
@@ -57,3 +93,6 @@ class StructuredLogger:
 
 def get_logger(name: str) -> logging.Logger:
     return StructuredLogger.get_logger(name)
+
+
+atexit.register(StructuredLogger.shutdown)
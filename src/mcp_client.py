@@ -1,16 +1,20 @@
 import asyncio
 import json
+import threading
 from contextlib import AsyncExitStack
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
+from . import json_utils
 from .logger import get_logger
 
 logger = get_logger(__name__)
 
+LOOP_STOP_TIMEOUT_S = 5.0
+
 
 class MCPServerConnection:
     def __init__(self, name: str, config: Dict[str, Any]):
@@ -166,6 +170,9 @@ class MCPClient:
     def __init__(self):
         self.servers: Dict[str, MCPServerConnection] = {}
         self.exit_stack = AsyncExitStack()
+        self._tools_cache: Optional[List[Dict[str, Any]]] = None
+        # 完整工具名 -> (服务器名, 工具名)；服务器名本身可能包含下划线，不能靠 split 解析
+        self._name_index: Optional[Dict[str, Tuple[str, str]]] = None
 
     async def connect_from_config(self, config: Dict[str, Any]) -> int:
         """
@@ -200,13 +207,25 @@ class MCPClient:
         else:
             print(f"📡 正在连接 {len(mcp_servers)} 个 MCP 服务器...")
 
+        # 各服务器的启动和握手互不依赖，并发连接，总耗时取决于最慢的一个
+        servers = [MCPServerConnection(name, server_config) for name, server_config in mcp_servers.items()]
+        results = await asyncio.gather(
+            *(server.connect(self.exit_stack) for server in servers),
+            return_exceptions=True,
+        )
+
         success_count = 0
-        for name, server_config in mcp_servers.items():
-            server = MCPServerConnection(name, server_config)
-            if await server.connect(self.exit_stack):
-                self.servers[name] = server
+        for server, connected in zip(servers, results):
+            if isinstance(connected, BaseException):
+                logger.error(f"连接 MCP 服务器 '{server.name}' 时发生异常: {connected}")
+                continue
+            if connected:
+                self.servers[server.name] = server
                 success_count += 1
 
+        self._tools_cache = None
+        self._name_index = None
+
         if success_count > 0:
             print(f"✨ 成功连接 {success_count}/{len(mcp_servers)} 个 MCP 服务器")
         else:
@@ -225,20 +244,14 @@ class MCPClient:
         Returns:
             Dict: 工具执行结果
         """
-        if not full_tool_name.startswith("mcp_"):
+        resolved = self.resolve_tool_name(full_tool_name)
+        if resolved is None:
             return {
                 "success": False,
-                "error": "工具名称格式错误",
+                "error": f"未知的 MCP 工具: {full_tool_name}",
             }
 
-        parts = full_tool_name[4:].split("_", 1)
-        if len(parts) != 2:
-            return {
-                "success": False,
-                "error": f"无法解析工具名称: {full_tool_name}",
-            }
-
-        server_name, tool_name = parts
+        server_name, tool_name = resolved
 
         server = self.servers.get(server_name)
         if not server:
@@ -256,10 +269,23 @@ class MCPClient:
         Returns:
             List[Dict]: OpenAI 格式的工具列表
         """
-        all_tools: List[Dict[str, Any]] = []
-        for server in self.servers.values():
-            all_tools.extend(server.get_tools_for_openai())
-        return all_tools
+        # 工具列表只在连接时从服务器获取，连接变化前结果不变
+        if self._tools_cache is None:
+            all_tools: List[Dict[str, Any]] = []
+            for server in self.servers.values():
+                all_tools.extend(server.get_tools_for_openai())
+            self._tools_cache = all_tools
+        return self._tools_cache
+
+    def resolve_tool_name(self, full_tool_name: str) -> Optional[Tuple[str, str]]:
+        """把 "mcp_<server_name>_<tool_name>" 解析为 (server_name, tool_name)，未知名称返回 None"""
+        if self._name_index is None:
+            self._name_index = {
+                f"mcp_{server.name}_{tool['name']}": (server.name, tool["name"])
+                for server in self.servers.values()
+                for tool in server.available_tools
+            }
+        return self._name_index.get(full_tool_name)
 
     async def cleanup(self) -> None:
         """清理资源"""
@@ -284,13 +310,41 @@ class MCPClient:
 
 
 class MCPClientManager:
-    """MCP 客户端管理器，支持异步操作的同步封装"""
+    """MCP 客户端管理器，支持异步操作的同步封装
+
+    所有协程都提交到后台线程中常驻的同一个事件循环，call_tool 可以在多个线程中并发调用。
+    """
 
     def __init__(self):
         self.client = MCPClient()
-        self.loop = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
         self._is_running = False
 
+    def _start_loop(self) -> None:
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, name="mcp-event-loop", daemon=True)
+        self._loop_thread.start()
+
+    def _run(self, coro):
+        """在后台事件循环中执行协程并阻塞等待结果（线程安全）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _stop_loop(self) -> None:
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        # 事件循环卡在某个回调里时不让退出流程无限等待；线程是 daemon，进程退出时会被回收
+        self._loop_thread.join(timeout=LOOP_STOP_TIMEOUT_S)
+        if self._loop_thread.is_alive():
+            logger.warning("MCP 事件循环未能及时停止")
+        else:
+            self.loop.close()
+        self.loop = None
+        self._loop_thread = None
+
     def connect_from_config_file(self, config_path: str) -> bool:
         """
         从配置文件连接到 MCP 服务器
@@ -309,13 +363,10 @@ class MCPClientManager:
                 print(f"❌ 配置文件不存在: {config_path}")
                 return False
 
-            with open(config_file, "r", encoding="utf-8") as handle:
-                config = json.load(handle)
-
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
+            config = json_utils.loads(config_file.read_bytes())
 
-            success_count = self.loop.run_until_complete(self.client.connect_from_config(config))
+            self._start_loop()
+            success_count = self._run(self.client.connect_from_config(config))
             if success_count > 0:
                 self._is_running = True
                 logger.info(f"MCP 客户端初始化成功，连接了 {success_count} 个服务器")
@@ -344,10 +395,8 @@ class MCPClientManager:
             bool: 是否成功连接至少一个服务器
         """
         try:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-
-            success_count = self.loop.run_until_complete(self.client.connect_from_config(config))
+            self._start_loop()
+            success_count = self._run(self.client.connect_from_config(config))
             if success_count > 0:
                 self._is_running = True
                 return True
@@ -376,7 +425,7 @@ class MCPClientManager:
             }
 
         try:
-            return self.loop.run_until_complete(self.client.call_tool(tool_name, arguments))
+            return self._run(self.client.call_tool(tool_name, arguments))
         except Exception as exc:
             return {
                 "success": False,
@@ -387,6 +436,10 @@ class MCPClientManager:
         """获取 OpenAI 格式的工具列表"""
         return self.client.get_all_tools_for_openai()
 
+    def resolve(self, tool_name: str) -> Optional[Tuple[str, str]]:
+        """解析完整工具名称为 (服务器名, 工具名)"""
+        return self.client.resolve_tool_name(tool_name)
+
     def get_servers_info(self) -> Dict[str, Any]:
         """获取所有服务器的信息"""
         return self.client.get_servers_info()
@@ -397,20 +450,20 @@ class MCPClientManager:
 
     def cleanup(self) -> None:
         """清理资源"""
-        if self._is_running and self.loop:
+        if self.loop:
             try:
                 logger.info("开始清理 MCP 客户端资源")
-                if not self.loop.is_closed():
+                if self._is_running:
                     try:
-                        self.loop.run_until_complete(self.client.cleanup())
+                        self._run(self.client.cleanup())
                         logger.debug("MCP 客户端清理完成")
                     except Exception as exc:
                         logger.error(f"清理 MCP 客户端时出错: {exc}")
-                    try:
-                        self.loop.close()
-                        logger.debug("事件循环已关闭")
-                    except Exception as exc:
-                        logger.error(f"关闭事件循环时出错: {exc}")
+                try:
+                    self._stop_loop()
+                    logger.debug("事件循环已关闭")
+                except Exception as exc:
+                    logger.error(f"关闭事件循环时出错: {exc}")
                 self._is_running = False
             except Exception as exc:
                 logger.error(f"MCP 清理过程异常: {exc}")
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-import time
-from typing import Any, Dict, List, Tuple
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
 from openai import OpenAI
 from rich.console import Console
@@ -9,6 +10,9 @@ from rich.status import Status
 
 from .config import Config
 
+# 超过此数量时整体清空，避免长会话中缓存无限增长
+MAX_TOKEN_CACHE_ENTRIES = 10_000
+
 
 class MessageManager:
 
@@ -25,59 +29,87 @@ class MessageManager:
         self.client = client
         self.encoding = encoding
         self.token_stats = token_stats
+        self._system_template: Optional[str] = None
+        self._summary_prompt: Optional[str] = None
+        # 文本 -> token 数；历史消息每轮都会重新计数，内容不变时直接命中
+        self._token_cache: Dict[str, int] = {}
+        # compress_if_needed 上次计数的结果：(消息数, 最后一条消息对象, token 数)
+        self._history_count: Optional[Tuple[int, Dict[str, Any], int]] = None
+
+    def load_system_template(self) -> str:
+        # 除 ${NOW_ISO} 外的占位符在进程生命周期内不变，只读取和替换一次
+        if self._system_template is None:
+            path = self.config.project_root / "prompts" / "system.md"
+            text = path.read_text(encoding="utf-8")
+            text = text.replace("${WORK_DIR}", str(self.config.work_dir))
+            text = text.replace("${OS_NAME}", self.config.os_name)
+            text = text.replace("${SHELL_TYPE}", self.config.shell_type)
+            self._system_template = text
+        return self._system_template
 
     def load_system(self) -> Dict[str, str]:
-        path = self.config.project_root / "prompts" / "system.md"
-        text = path.read_text(encoding="utf-8")
-        text = text.replace("${WORK_DIR}", str(self.config.work_dir))
-        text = text.replace("${NOW_ISO}", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
-        text = text.replace("${OS_NAME}", self.config.os_name)
-        text = text.replace("${SHELL_TYPE}", self.config.shell_type)
+        text = self.load_system_template()
+        now_iso = datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+        text = text.replace("${NOW_ISO}", now_iso)
         return {"role": "system", "content": text}
 
     def _load_summary_prompt(self) -> str:
-        path = self.config.project_root / "prompts" / "summary.md"
-        return path.read_text(encoding="utf-8")
+        # 每次压缩都会用到，与系统提示词模板一样只读取一次
+        if self._summary_prompt is None:
+            path = self.config.project_root / "prompts" / "summary.md"
+            self._summary_prompt = path.read_text(encoding="utf-8")
+        return self._summary_prompt
+
+    def count_text_tokens(self, text: str) -> int:
+        count = self._token_cache.get(text)
+        if count is None:
+            if len(self._token_cache) >= MAX_TOKEN_CACHE_ENTRIES:
+                self._token_cache.clear()
+            count = self._token_cache[text] = len(self.encoding.encode(text))
+        return count
 
     def count_message_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        count = self.count_text_tokens
         num_tokens = 0
         for message in messages:
             num_tokens += 4
 
             if isinstance(message.get("content"), str):
-                num_tokens += len(self.encoding.encode(message["content"]))
+                num_tokens += count(message["content"])
 
-            num_tokens += len(self.encoding.encode(message.get("role", "")))
+            num_tokens += count(message.get("role", ""))
 
             if "tool_calls" in message:
                 for tool_call in message["tool_calls"]:
                     if "function" in tool_call:
-                        num_tokens += len(self.encoding.encode(tool_call["function"].get("name", "")))
-                        num_tokens += len(self.encoding.encode(tool_call["function"].get("arguments", "")))
+                        num_tokens += count(tool_call["function"].get("name", ""))
+                        num_tokens += count(tool_call["function"].get("arguments", ""))
 
             if "name" in message:
-                num_tokens += len(self.encoding.encode(message["name"]))
+                num_tokens += count(message["name"])
 
         return num_tokens + 2
 
     def _summarize_messages(self, messages_to_summarize: List[Dict[str, Any]]) -> str:
         system_prompt = self._load_summary_prompt()
-        history_content = "请总结以下对话历史：\n\n"
+        parts = ["请总结以下对话历史：\n\n"]
 
         for message in messages_to_summarize:
             role = message.get("role", "unknown")
             content = message.get("content", "")
             if role == "user":
-                history_content += f"用户: {content}\n\n"
+                parts.append(f"用户: {content}\n\n")
             elif role == "assistant":
-                history_content += f"助手: {content}\n"
+                parts.append(f"助手: {content}\n")
                 for tool_call in message.get("tool_calls", []):
                     func_name = tool_call.get("function", {}).get("name", "")
-                    history_content += f"  [调用工具: {func_name}]\n"
-                history_content += "\n"
+                    parts.append(f"  [调用工具: {func_name}]\n")
+                parts.append("\n")
             elif role == "tool":
                 tool_name = message.get("name", "")
-                history_content += f"[工具 {tool_name} 返回结果]\n\n"
+                parts.append(f"[工具 {tool_name} 返回结果]\n\n")
+
+        history_content = "".join(parts)
 
         try:
             response = self.client.chat.completions.create(
@@ -149,8 +181,10 @@ class MessageManager:
     ) -> List[Dict[str, Any]]:
         current_tokens = self.count_message_tokens(messages)
 
-        system_messages = [msg for msg in messages if msg.get("role") == "system"]
-        non_system_messages = [msg for msg in messages if msg.get("role") != "system"]
+        system_messages: List[Dict[str, Any]] = []
+        non_system_messages: List[Dict[str, Any]] = []
+        for msg in messages:
+            (system_messages if msg.get("role") == "system" else non_system_messages).append(msg)
 
         if len(non_system_messages) <= self.config.keep_recent_messages:
             if not force:
@@ -191,7 +225,12 @@ class MessageManager:
             self.console.print(f"[cyan]即将压缩:[/cyan] {len(old_messages)} 条消息, {old_tokens:,} tokens")
 
         self.console.print(f"[bold blue]🔄 正在总结 {len(old_messages)} 条历史消息...[/bold blue]")
-        with Status("[bold blue]压缩消息中...", spinner="dots"):
+        # 总结请求可能持续数秒，降低刷新频率；非终端输出时不显示动画
+        if self.console.is_terminal:
+            status = Status("[bold blue]压缩消息中...", console=self.console, spinner="dots", refresh_per_second=4)
+        else:
+            status = nullcontext()
+        with status:
             summary = self._summarize_messages(old_messages)
 
         summary_message = {
@@ -202,6 +241,14 @@ class MessageManager:
         compressed_messages = system_messages + [summary_message] + recent_messages
 
         new_tokens = self.count_message_tokens(compressed_messages)
+        if force and new_tokens > self.config.max_context_tokens:
+            prefix = system_messages + [summary_message]
+            recent_messages = self._trim_recent_messages(
+                recent_messages,
+                self.config.max_context_tokens - self.count_message_tokens(prefix),
+            )
+            compressed_messages = prefix + recent_messages
+            new_tokens = self.count_message_tokens(compressed_messages)
         saved_tokens = current_tokens - new_tokens
 
         self.token_stats["compressions"] += 1
@@ -221,8 +268,44 @@ class MessageManager:
 
         return compressed_messages
 
+    def _trim_recent_messages(
+        self,
+        messages: List[Dict[str, Any]],
+        budget: int,
+    ) -> List[Dict[str, Any]]:
+        """总结后仍超出上限时，从最旧的消息开始丢弃，assistant 与其 tool 结果整体丢弃。"""
+        tokens = self.count_message_tokens(messages)
+        start = 0
+        while tokens > budget and len(messages) - start > 1:
+            end = start + 1
+            while end < len(messages) and messages[end].get("role") == "tool":
+                end += 1
+            if end >= len(messages):
+                break
+            tokens -= self.count_message_tokens(messages[start:end]) - 2
+            start = end
+
+        if start:
+            self.console.print(f"[bold yellow]⚠️  总结后仍超出上限，已丢弃最早的 {start} 条消息[/bold yellow]")
+        return messages[start:]
+
+    def _count_history_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """对话历史通常只追加：上次计数的最后一条消息仍在原位时，只计算其后新增的消息。"""
+        counted = self._history_count
+        if counted is not None:
+            length, last, tokens = counted
+            if 0 < length <= len(messages) and messages[length - 1] is last:
+                if length < len(messages):
+                    tokens += self.count_message_tokens(messages[length:]) - 2
+                    self._history_count = (len(messages), messages[-1], tokens)
+                return tokens
+
+        tokens = self.count_message_tokens(messages)
+        self._history_count = (len(messages), messages[-1], tokens) if messages else None
+        return tokens
+
     def compress_if_needed(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        current_tokens = self.count_message_tokens(messages)
+        current_tokens = self._count_history_tokens(messages)
         if current_tokens <= self.config.max_context_tokens:
             return messages
         self.console.print(
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
-import os
+import codecs
+import functools
+import locale
 import pathlib
+import re
 import shlex
 import subprocess
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
+from stat import S_ISREG
+from typing import Callable, Optional, Tuple
 
 from .config import Config
 from .logger import get_logger
+from .shell import get_shell_pool
 
 logger = get_logger(__name__)
 
@@ -29,6 +38,33 @@ DANGEROUS_TOKENS = [
     "chown -R /",
 ]
 
+SENSITIVE_DIRS = [
+    " /etc",
+    " /root",
+]
+
+
+def _alternation(words: list[str]) -> str:
+    return "|".join(re.escape(word) for word in words)
+
+
+# 敏感目录前的空格匹配任意空白（制表符、换行），多行命令不能借此绕过
+_SENSITIVE_ALTERNATION = "|".join(rf"(?:^|\s){re.escape(path.strip())}" for path in SENSITIVE_DIRS)
+
+# 一次编译全部规则，单次扫描即可判断；命名分组用于区分日志中的命中类型
+_DANGER_RE = re.compile(
+    f"(?P<pattern>{_alternation(DENY_PATTERNS)})"
+    f"|(?P<token>{_alternation(DANGEROUS_TOKENS)})"
+    f"|(?P<sensitive>{_SENSITIVE_ALTERNATION})",
+    re.IGNORECASE,
+)
+
+_DANGER_LOG_MESSAGES = {
+    "pattern": "检测到危险命令模式",
+    "token": "检测到危险命令 token",
+    "sensitive": "检测到访问敏感目录",
+}
+
 
 @dataclass
 class BashResult:
@@ -40,38 +76,185 @@ class BashResult:
 
 
 def is_obviously_dangerous(command: str) -> bool:
-    lowered = command.strip().lower()
-    if any(pattern in lowered for pattern in DENY_PATTERNS):
-        logger.warning(f"检测到危险命令模式: {command[:50]}")
-        return True
-    if any(token in lowered for token in DANGEROUS_TOKENS):
-        logger.warning(f"检测到危险命令 token: {command[:50]}")
-        return True
-    if " /etc" in lowered or " /root" in lowered:
-        logger.warning(f"检测到访问敏感目录: {command[:50]}")
+    match = _DANGER_RE.search(command)
+    if match is None:
+        return False
+    logger.warning(f"{_DANGER_LOG_MESSAGES[match.lastgroup]}: {command[:50]}")
+    return True
+
+
+# 以 "/" 开头的参数（绝对路径）或作为路径分量出现的 ".."；边界包括空白、引号、反斜杠、"=" 和 shell 操作符，
+# 因此 --file=/etc/x、cd ..&&ls、cat \/etc/x 这类写法也能识别
+_OUTSIDE_PATH_RE = re.compile(
+    r"""(?:^|[\s'"=;&|()<>`\\])/"""
+    r"""|(?:^|[\s'"=;&|()<>`/\\])\.\.(?:$|[\s'"=;&|()<>`/\\])"""
+)
+
+
+def _has_outside_token(command: str) -> bool:
+    # 按 shell 规则去掉转义后再逐个检查参数，覆盖 \.\. 这类正则看不出的写法
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        # 引号不配对时无法判断，按越界处理
         return True
-    return False
+    return any(token.startswith("/") or ".." in pathlib.PurePosixPath(token).parts for token in tokens)
 
 
 def is_outside_workdir(command: str, work_dir: pathlib.Path) -> bool:
-    tokens = shlex.split(command) if command.strip() else []
-    for token in tokens:
-        if token.startswith("/"):
-            return True
-        if ".." in pathlib.PurePosixPath(token).parts:
-            return True
-    return False
+    # 绝对路径必含 "/"，上级目录必含 ".."，转义写法必含反斜杠；三者都没有时无需扫描
+    if "/" not in command and ".." not in command and "\\" not in command:
+        return False
+    if _OUTSIDE_PATH_RE.search(command) is not None:
+        return True
+    # 没有反斜杠时正则已覆盖全部情况；有反斜杠时再用 shlex 确认
+    return "\\" in command and _has_outside_token(command)
 
 
-def run_bash(command: str, config: Config, timeout_s: int = 30) -> BashResult:
-    logger.info(f"准备执行命令: {command[:100]}{'...' if len(command) > 100 else ''}")
-
+@functools.lru_cache(maxsize=256)
+def _classify_command(command: str, work_dir: pathlib.Path) -> Tuple[str, str]:
+    """返回 (拦截原因, 命中的危险规则类型)；不记日志、没有副作用，可以按命令缓存。"""
     if not command.strip():
-        logger.warning("命令为空，拒绝执行")
-        return BashResult("", "empty command", 1, ran=False, reason="empty")
+        return "empty", ""
+    # 先判断危险命令：sudo rm -rf / 这类同时越界的命令应报告为 dangerous
+    match = _DANGER_RE.search(command)
+    if match is not None:
+        return "dangerous", match.lastgroup
+    if is_outside_workdir(command, work_dir):
+        return "path_outside", ""
+    return "", ""
+
 
-    if is_outside_workdir(command, config.work_dir):
+def check_command(command: str, work_dir: pathlib.Path) -> str:
+    """返回命令被拦截的原因（empty/dangerous/path_outside），通过时返回空串。
+
+    分类结果按命令缓存：ToolHandler 在确认前检查一次，run_bash 再次检查时直接命中缓存；
+    日志每次都记录，被拦截命令的重试同样留有审计记录。
+    """
+    reason, rule = _classify_command(command, work_dir)
+    if reason == "empty":
+        logger.warning("命令为空，拒绝执行")
+    elif reason == "dangerous":
+        logger.warning(f"{_DANGER_LOG_MESSAGES[rule]}: {command[:50]}")
+        logger.error(f"命令被安全检查拦截: {command[:50]}")
+    elif reason == "path_outside":
         logger.warning(f"命令尝试访问工作目录外的路径: {command[:50]}")
+    return reason
+
+
+READ_ONLY_COMMAND_RE = re.compile(r"^\s*(?:ls|pwd|cat|head|tail|wc|file|stat|grep|git\s+(?:status|log))(?:\s|$)")
+# 出现这些字符意味着可能有重定向、管道、命令替换或多条命令，不再视为只读
+_SHELL_CONTROL_CHARS = frozenset(";&|<>`$()\n")
+
+
+def is_read_only_command(command: str) -> bool:
+    if not READ_ONLY_COMMAND_RE.match(command):
+        return False
+    return _SHELL_CONTROL_CHARS.isdisjoint(command)
+
+
+# 参数中出现这些字符时 shell 会展开路径，结果取决于目录内容
+_GLOB_CHARS = frozenset("*?[~")
+
+
+def _is_recursive_flag(token: str) -> bool:
+    if token.startswith("--"):
+        return token in ("--recursive", "--dereference-recursive")
+    return "r" in token or "R" in token
+
+
+class _ResultCache:
+    """只读命令的短期结果缓存。
+
+    键包含命令中每个参数对应文件的 (mtime, size, inode)，文件内容被任何途径改写后都会失效；
+    参数是目录、通配符、git 或递归 grep 时输出取决于整棵目录树，不缓存。此外任何非只读命令
+    和 MCP 工具调用都会让缓存整体失效，TTL 兜底其余情况。
+    """
+
+    def __init__(self, maxsize: int = 64, ttl_s: float = 5.0) -> None:
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[Tuple, Tuple[float, BashResult]] = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, command: str, work_dir: pathlib.Path) -> Optional[Tuple]:
+        try:
+            tokens = shlex.split(command)
+        except ValueError:
+            return None
+        if not tokens or tokens[0] == "git":
+            return None
+        signatures = []
+        for token in tokens[1:]:
+            if token.startswith("-"):
+                if tokens[0] == "grep" and _is_recursive_flag(token):
+                    return None
+                continue
+            if _GLOB_CHARS & set(token):
+                return None
+            try:
+                stat = (work_dir / token).stat()
+            except OSError:
+                # 不存在的参数（grep 的模式、head -n 的数值）也计入键，文件被创建后自然失效
+                signatures.append((token, None))
+                continue
+            if not S_ISREG(stat.st_mode):
+                return None
+            signatures.append((token, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        if tokens[0] == "ls" and not signatures:
+            # 不带参数的 ls 列出的是工作目录本身
+            return None
+        return (command, work_dir, tuple(signatures), self._generation)
+
+    def get(self, key: Tuple) -> Optional[BashResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl_s:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def set(self, key: Tuple, result: BashResult) -> None:
+        with self._lock:
+            if key[-1] != self._generation:
+                return
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+_result_cache = _ResultCache()
+
+
+def invalidate_result_cache() -> None:
+    """清空只读命令的结果缓存；执行可能改写文件的工具（例如 MCP）前后调用。"""
+    _result_cache.invalidate()
+
+
+def run_bash(
+    command: str,
+    config: Config,
+    timeout_s: int = 30,
+    on_output: Optional[Callable[[str, bool], None]] = None,
+) -> BashResult:
+    """执行命令；on_output(text, is_stderr) 在输出到达时被调用（仅 bash 会话支持实时输出）。"""
+    logger.info(f"准备执行命令: {command[:100]}{'...' if len(command) > 100 else ''}")
+
+    blocked_reason = check_command(command, config.work_dir)
+    if blocked_reason == "empty":
+        return BashResult("", "empty command", 1, ran=False, reason="empty")
+    if blocked_reason == "path_outside":
         return BashResult(
             "",
             f"blocked: path outside WORK_DIR ({config.work_dir})",
@@ -79,11 +262,52 @@ def run_bash(command: str, config: Config, timeout_s: int = 30) -> BashResult:
             ran=False,
             reason="path_outside",
         )
-
-    if is_obviously_dangerous(command):
-        logger.error(f"命令被安全检查拦截: {command[:50]}")
+    if blocked_reason == "dangerous":
         return BashResult("", "blocked: dangerous command", 1, ran=False, reason="dangerous")
 
+    if not is_read_only_command(command):
+        _result_cache.invalidate()
+        try:
+            return _execute(command, config, timeout_s, on_output)
+        finally:
+            _result_cache.invalidate()
+
+    key = _result_cache.make_key(command, config.work_dir)
+    cached = _result_cache.get(key) if key is not None else None
+    if cached is not None:
+        logger.info(f"只读命令命中结果缓存: {command[:50]}")
+        return cached
+
+    result = _execute(command, config, timeout_s, on_output)
+    if key is not None and result.ran:
+        _result_cache.set(key, result)
+    return result
+
+
+def _decoding_callback(
+    on_output: Callable[[str, bool], None],
+    encoding: str,
+) -> Callable[[bytes, bool], None]:
+    # 每个流一个增量解码器，避免多字节字符被 chunk 边界截断
+    decoders = {
+        False: codecs.getincrementaldecoder(encoding)(errors="replace"),
+        True: codecs.getincrementaldecoder(encoding)(errors="replace"),
+    }
+
+    def callback(data: bytes, is_stderr: bool) -> None:
+        text = decoders[is_stderr].decode(data)
+        if text:
+            on_output(text, is_stderr)
+
+    return callback
+
+
+def _execute(
+    command: str,
+    config: Config,
+    timeout_s: int,
+    on_output: Optional[Callable[[str, bool], None]],
+) -> BashResult:
     try:
         logger.debug(f"在目录 {config.work_dir} 中执行命令，超时设置: {timeout_s}s")
         if config.shell_type == "cmd":
@@ -92,28 +316,28 @@ def run_bash(command: str, config: Config, timeout_s: int = 30) -> BashResult:
                 cwd=config.work_dir,
                 shell=True,
                 capture_output=True,
-                text=True,
                 timeout=timeout_s,
-                env=os.environ.copy(),
                 executable="cmd.exe",
             )
+            encoding = locale.getpreferredencoding(False)
+            raw_stdout, raw_stderr, exit_code = proc.stdout, proc.stderr, proc.returncode
         else:
-            proc = subprocess.run(
+            encoding = "utf-8"
+            raw_stdout, raw_stderr, exit_code = get_shell_pool(config.work_dir).run(
                 command,
-                cwd=config.work_dir,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=timeout_s,
-                env=os.environ.copy(),
-                executable="/bin/bash",
+                timeout_s,
+                _decoding_callback(on_output, encoding) if on_output else None,
             )
 
-        result = BashResult(proc.stdout, proc.stderr, proc.returncode, ran=True)
+        # 只在拿到完整输出后解码一次；无法解码的字节替换掉而不是让整个命令报错
+        stdout = raw_stdout.decode(encoding, errors="replace")
+        stderr = raw_stderr.decode(encoding, errors="replace")
+
+        result = BashResult(stdout, stderr, exit_code, ran=True)
         if result.exit_code == 0:
             logger.info(f"命令执行成功，退出码: {result.exit_code}")
         else:
-            logger.warning(f"命令执行失败，退出码: {result.exit_code}, stderr: {proc.stderr[:100]}")
+            logger.warning(f"命令执行失败，退出码: {result.exit_code}, stderr: {stderr[:100]}")
         return result
 
     except subprocess.TimeoutExpired:
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import atexit
+import os
+import pathlib
+import re
+import selectors
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+READ_CHUNK_SIZE = 65536
+MAX_CAPTURE_BYTES = 1024 * 1024
+
+# 输出回调：(data, is_stderr)，在数据到达时实时调用
+OutputCallback = Callable[[bytes, bool], None]
+
+
+class _BoundedCapture:
+    """只保留输出的开头和结尾各 limit/2 字节，内存占用与命令输出量无关。"""
+
+    def __init__(self, limit: int = MAX_CAPTURE_BYTES) -> None:
+        self._half = limit // 2
+        self._head = bytearray()
+        self._tail: Deque[bytes] = deque()
+        self._tail_size = 0
+        self._dropped = 0
+
+    def append(self, data: bytes) -> None:
+        room = self._half - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if not data:
+            return
+        self._tail.append(data)
+        self._tail_size += len(data)
+        while self._tail_size - len(self._tail[0]) >= self._half:
+            self._dropped += len(self._tail[0])
+            self._tail_size -= len(self._tail.popleft())
+
+    def getvalue(self) -> bytes:
+        tail = b"".join(self._tail)
+        extra = len(tail) - self._half
+        dropped = self._dropped
+        if extra > 0:
+            tail = tail[extra:]
+            dropped += extra
+        if not dropped:
+            return bytes(self._head) + tail
+        return bytes(self._head) + f"\n...[省略 {dropped} 字节]...\n".encode() + tail
+
+
+class ShellSession:
+    """常驻的 bash 子进程，通过管道逐条执行命令，省去每次 fork+exec+初始化 shell 的开销。
+
+    每条命令的输出写入各自的一对 FIFO：命令放到后台的子进程即使还持有写端，读到结束标记后
+    FIFO 就被关闭删除，其后续输出不会混进下一条命令。
+    """
+
+    def __init__(self, work_dir: pathlib.Path, executable: str = "/bin/bash") -> None:
+        self._marker = f"__BASH_AGENT_{uuid.uuid4().hex}__".encode()
+        self._fifo_dir = tempfile.mkdtemp(prefix="bash-agent-")
+        self._command_count = 0
+        self.proc = subprocess.Popen(
+            [executable],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=work_dir,
+            start_new_session=True,
+            bufsize=0,
+        )
+        logger.debug(f"启动常驻 shell 进程, pid: {self.proc.pid}")
+
+    def is_alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def run(
+        self,
+        command: str,
+        timeout_s: float,
+        on_output: Optional[OutputCallback] = None,
+    ) -> Tuple[bytes, bytes, int]:
+        """执行一条命令，返回 (stdout, stderr, exit_code)；超时会杀掉整个 shell 并抛出 TimeoutExpired。
+
+        on_output 会随输出到达被调用，不受 MAX_CAPTURE_BYTES 截断影响。
+        """
+        self._command_count += 1
+        paths = {
+            is_stderr: os.path.join(self._fifo_dir, f"{self._command_count}.{'err' if is_stderr else 'out'}")
+            for is_stderr in (False, True)
+        }
+        fds: List[int] = []
+        try:
+            read_fds: Dict[int, bool] = {}
+            for is_stderr, path in paths.items():
+                os.mkfifo(path, 0o600)
+                read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                fds.append(read_fd)
+                # 自己也持有一个写端：shell 打开 FIFO 之前读不到 EOF，shell 是否退出改由其 stdout 判断
+                fds.append(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+                read_fds[read_fd] = is_stderr
+            return self._run_with_fifos(command, timeout_s, on_output, paths, read_fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+            for path in paths.values():
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _run_with_fifos(
+        self,
+        command: str,
+        timeout_s: float,
+        on_output: Optional[OutputCallback],
+        paths: Dict[bool, str],
+        read_fds: Dict[int, bool],
+    ) -> Tuple[bytes, bytes, int]:
+        # 命令作为字符串数据传入，在子 shell 中 eval：cd/exit/语法错误都不会影响常驻 shell
+        marker = self._marker.decode()
+        script = (
+            f"__bash_agent_cmd={shlex.quote(command)}\n"
+            '{ ( eval "$__bash_agent_cmd" ) </dev/null\n'
+            f"printf '{marker}%d\\n' $?\n"
+            f"printf '{marker}\\n' >&2\n"
+            f"}} >{shlex.quote(paths[False])} 2>{shlex.quote(paths[True])}\n"
+        )
+        data = memoryview(script.encode())
+        while data:
+            data = data[os.write(self.proc.stdin.fileno(), data):]
+
+        deadline = time.monotonic() + timeout_s
+        captures = {False: _BoundedCapture(), True: _BoundedCapture()}
+        # 可能是结束标记开头的尾部数据先暂存，其余数据立即输出
+        pending = {False: bytearray(), True: bytearray()}
+        exit_code: Optional[int] = None
+
+        def emit(is_stderr: bool, data: bytes) -> None:
+            if not data:
+                return
+            captures[is_stderr].append(data)
+            if on_output is not None:
+                on_output(data, is_stderr)
+
+        with selectors.DefaultSelector() as selector:
+            for fd in read_fds:
+                selector.register(fd, selectors.EVENT_READ)
+            # shell 的 stdout 不再承载命令输出，读到 EOF 说明 shell 意外退出（例如命令 kill 了父进程）
+            selector.register(self.proc.stdout, selectors.EVENT_READ)
+            open_fds = set(read_fds)
+
+            while open_fds:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.close()
+                    raise subprocess.TimeoutExpired(command, timeout_s)
+
+                for key, _ in selector.select(remaining):
+                    if key.fileobj is self.proc.stdout:
+                        if os.read(key.fd, READ_CHUNK_SIZE):
+                            continue
+                        for fd in open_fds:
+                            emit(read_fds[fd], self._drain(fd, pending[read_fds[fd]]))
+                        open_fds.clear()
+                        break
+
+                    if key.fd not in open_fds:
+                        continue
+                    is_stderr = read_fds[key.fd]
+                    try:
+                        chunk = os.read(key.fd, READ_CHUNK_SIZE)
+                    except BlockingIOError:
+                        continue
+                    buffer = pending[is_stderr]
+                    buffer += chunk
+                    position = buffer.find(self._marker)
+                    if position < 0:
+                        ready = len(buffer) - self._partial_marker_length(buffer)
+                        emit(is_stderr, bytes(buffer[:ready]))
+                        del buffer[:ready]
+                        continue
+
+                    emit(is_stderr, bytes(buffer[:position]))
+                    del buffer[:position]
+                    line_end = buffer.find(b"\n", len(self._marker))
+                    if line_end < 0:
+                        continue
+                    if not is_stderr:
+                        # 只解析标记后到换行为止的数字；之后的字节（后台进程的迟到输出）直接丢弃
+                        digits = re.match(rb"\d+", buffer[len(self._marker):line_end])
+                        exit_code = int(digits.group()) if digits else 1
+                    selector.unregister(key.fd)
+                    open_fds.discard(key.fd)
+
+        if exit_code is None:
+            exit_code = self.proc.wait()
+            self.close()
+        return captures[False].getvalue(), captures[True].getvalue(), exit_code
+
+    @staticmethod
+    def _drain(fd: int, buffer: bytearray) -> bytes:
+        """读出 FIFO 中剩余的全部数据，连同暂存的尾部一起返回。"""
+        while True:
+            try:
+                chunk = os.read(fd, READ_CHUNK_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            buffer += chunk
+        return bytes(buffer)
+
+    def _partial_marker_length(self, buffer: bytearray) -> int:
+        """buffer 末尾与结束标记开头重合的字节数。"""
+        first = self._marker[:1]
+        index = buffer.find(first, max(0, len(buffer) - len(self._marker) + 1))
+        while index >= 0:
+            if self._marker.startswith(buffer[index:]):
+                return len(buffer) - index
+            index = buffer.find(first, index + 1)
+        return 0
+
+    def close(self) -> None:
+        if self.is_alive():
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout):
+            stream.close()
+        shutil.rmtree(self._fifo_dir, ignore_errors=True)
+
+
+class ShellPool:
+    """按需复用空闲的 ShellSession，并行调用时各自占用一个会话。"""
+
+    def __init__(self, work_dir: pathlib.Path) -> None:
+        self.work_dir = work_dir
+        self._idle: List[ShellSession] = []
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        command: str,
+        timeout_s: float,
+        on_output: Optional[OutputCallback] = None,
+    ) -> Tuple[bytes, bytes, int]:
+        session = None
+        with self._lock:
+            while self._idle and session is None:
+                candidate = self._idle.pop()
+                if candidate.is_alive():
+                    session = candidate
+                else:
+                    candidate.close()
+        if session is None:
+            session = ShellSession(self.work_dir)
+
+        try:
+            result = session.run(command, timeout_s, on_output)
+        except BaseException:
+            session.close()
+            raise
+
+        if session.is_alive():
+            with self._lock:
+                self._idle.append(session)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            session.close()
+
+
+_pools: Dict[pathlib.Path, ShellPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_shell_pool(work_dir: pathlib.Path) -> ShellPool:
+    with _pools_lock:
+        pool = _pools.get(work_dir)
+        if pool is None:
+            pool = _pools[work_dir] = ShellPool(work_dir)
+        return pool
+
+
+def shutdown_shells() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(shutdown_shells)
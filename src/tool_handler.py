@@ -1,22 +1,45 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Callable, Dict, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
-from rich.console import Console
+from rich.console import Console, Group
 from rich.status import Status
+from rich.text import Text
 
+from . import json_utils
 from .config import Config
 from .security import (
-    BashResult,
-    is_obviously_dangerous,
-    is_outside_workdir,
+    check_command,
+    invalidate_result_cache,
+    is_read_only_command,
     run_bash,
 )
 from .logger import get_logger
 
 logger = get_logger(__name__)
 
+MAX_PARALLEL_TOOL_CALLS = 8
+MAX_TOOL_OUTPUT_CHARS = 8192
+# 工具执行超过该时长才显示 spinner，快命令不启动渲染线程
+STATUS_DELAY_S = 0.1
+
+
+def truncate_output(text: str, limit: int = MAX_TOOL_OUTPUT_CHARS) -> str:
+    """保留输出的首尾各一半，中间部分以提示替代，避免超长输出撑爆上下文。"""
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    dropped = len(text) - half * 2
+    return f"{text[:half]}\n...[省略 {dropped} 个字符]...\n{text[-half:]}"
+
+
+def _not_run_payload(reason: str, stderr: str) -> Dict[str, Any]:
+    """命令未执行（被拦截、为空或用户取消）时返回给模型的结果。"""
+    return {"ok": False, "ran": False, "reason": reason, "stdout": "", "stderr": stderr, "exit_code": 1}
+
 
 class ToolHandler:
 
@@ -26,13 +49,25 @@ class ToolHandler:
         console: Console,
         confirm: Callable[[str], bool],
         mcp_manager: Optional[Any] = None,
+        confirm_many: Optional[Callable[[List[str]], bool]] = None,
     ) -> None:
         self.config = config
         self.console = console
         self.confirm = confirm
+        self.confirm_many = confirm_many or (lambda commands: all(confirm(command) for command in commands))
         self.mcp_manager = mcp_manager
+        self._tools: Optional[List[Dict[str, Any]]] = None
 
     def get_tools(self) -> List[Dict[str, Any]]:
+        # 工具列表在会话内基本不变，构建一次后复用；MCP 连接变化时调用 invalidate_tools
+        if self._tools is None:
+            self._tools = self._build_tools()
+        return self._tools
+
+    def invalidate_tools(self) -> None:
+        self._tools = None
+
+    def _build_tools(self) -> List[Dict[str, Any]]:
         tools: List[Dict[str, Any]] = [
             {
                 "type": "function",
@@ -70,116 +105,245 @@ class ToolHandler:
 
     def handle_tool_calls(self, messages: List[Dict[str, Any]], tool_calls) -> None:
         logger.info(f"开始处理 {len(tool_calls)} 个工具调用")
-        for tool_call in tool_calls:
-            name = tool_call.function.name
-            args = json.loads(tool_call.function.arguments or "{}")
-            logger.debug(f"工具调用: {name}, 参数: {str(args)[:100]}")
-
-            if name == "bash_exec":
-                payload = self._handle_bash_exec(args)
-            elif name.startswith("mcp_"):
-                payload = self._handle_mcp_tool(name, args)
-            else:
-                logger.warning(f"未知工具: {name}")
-                payload = {"ok": False, "error": "unknown tool"}
+        # 参数只解析一次，分批判断和实际执行共用
+        arguments = [self._parse_arguments(tool_call) for tool_call in tool_calls]
+        payloads: List[Optional[Dict[str, Any]]] = [None] * len(tool_calls)
+        # 连续的可并行调用攒成一批；会修改环境的命令作为分隔点串行执行，保证前后依赖顺序不变
+        batch: List[int] = []
+        for index, tool_call in enumerate(tool_calls):
+            if self._can_run_in_parallel(tool_call.function.name, arguments[index]):
+                batch.append(index)
+                continue
+            self._run_batch(tool_calls, arguments, batch, payloads)
+            batch = []
+            payloads[index] = self._dispatch(tool_call, arguments[index])
+        self._run_batch(tool_calls, arguments, batch, payloads)
 
-            logger.debug(f"工具 {name} 执行结果: ok={payload.get('ok', False)}")
+        # 按原始顺序写回，保证 tool_call_id 与 assistant 消息一一对应
+        for tool_call, payload in zip(tool_calls, payloads):
             messages.append(
                 {
                     "role": "tool",
                     "tool_call_id": tool_call.id,
-                    "name": name,
-                    "content": json.dumps(payload, ensure_ascii=False),
+                    "name": tool_call.function.name,
+                    "content": json_utils.dumps(payload),
                 }
             )
 
-    def _handle_bash_exec(self, args: Dict[str, Any]) -> Dict[str, Any]:
+    def _run_batch(
+        self,
+        tool_calls,
+        arguments: List[Optional[Dict[str, Any]]],
+        batch: List[int],
+        payloads: List[Optional[Dict[str, Any]]],
+    ) -> None:
+        if len(batch) == 1:
+            payloads[batch[0]] = self._dispatch(tool_calls[batch[0]], arguments[batch[0]])
+            return
+        if not batch:
+            return
+
+        # 需要确认时一次性展示整批命令，避免每条命令都等待用户输入
+        approved: Optional[bool] = None
+        if self.config.confirm_before_exec:
+            commands = [
+                command
+                for command in (self._bash_command(tool_calls[index].function.name, arguments[index]) for index in batch)
+                if command is not None and not check_command(command, self.config.work_dir)
+            ]
+            if commands:
+                approved = self.confirm_many(commands)
+
+        logger.info(f"并行执行 {len(batch)} 个工具调用")
+        workers = min(MAX_PARALLEL_TOOL_CALLS, len(batch))
+        with self._delayed_status(f"[bold blue]并行执行 {len(batch)} 个工具调用中..."):
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    index: pool.submit(self._dispatch, tool_calls[index], arguments[index], False, approved)
+                    for index in batch
+                }
+        for index, future in futures.items():
+            payloads[index] = future.result()
+
+    def _can_run_in_parallel(self, name: str, args: Optional[Dict[str, Any]]) -> bool:
+        # MCP 调用提交到后台事件循环，可以并发；bash 只有只读命令才与其他调用并行
+        if name.startswith("mcp_"):
+            return args is not None
+        command = self._bash_command(name, args)
+        return command is not None and is_read_only_command(command)
+
+    @staticmethod
+    def _bash_command(name: str, args: Optional[Dict[str, Any]]) -> Optional[str]:
+        if name != "bash_exec" or args is None:
+            return None
+        command = args.get("command", "")
+        return command if isinstance(command, str) else None
+
+    @staticmethod
+    def _parse_arguments(tool_call) -> Optional[Dict[str, Any]]:
+        raw_args = tool_call.function.arguments
+        # 无参工具（常见于 MCP）通常只传 "{}"，无需解析
+        if not raw_args or raw_args == "{}":
+            return {}
+        try:
+            args = json_utils.loads(raw_args)
+        except ValueError:
+            logger.warning(f"工具参数不是合法的 JSON: {raw_args[:100]}")
+            return None
+        return args if isinstance(args, dict) else None
+
+    def _dispatch(
+        self,
+        tool_call,
+        args: Optional[Dict[str, Any]],
+        show_status: bool = True,
+        approved: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        name = tool_call.function.name
+        if args is None:
+            return {"ok": False, "error": "invalid arguments: expected a JSON object"}
+        logger.debug("工具调用: %s, 参数: %.100s", name, args)
+
+        if name == "bash_exec":
+            payload = self._handle_bash_exec(args, show_status, approved)
+        elif name.startswith("mcp_"):
+            payload = self._handle_mcp_tool(name, args, show_status)
+        else:
+            logger.warning(f"未知工具: {name}")
+            payload = {"ok": False, "error": "unknown tool"}
+
+        logger.debug("工具 %s 执行结果: ok=%s", name, payload.get("ok", False))
+        return payload
+
+    @contextmanager
+    def _delayed_status(self, message: str) -> Iterator[None]:
+        """执行超过 STATUS_DELAY_S 后才显示 spinner；工具本身仍在当前线程执行，Ctrl+C 照常中断。"""
+        status = Status(message, console=self.console, spinner="dots")
+        lock = threading.Lock()
+        state = {"done": False, "started": False}
+
+        def start() -> None:
+            with lock:
+                if not state["done"]:
+                    status.start()
+                    state["started"] = True
+
+        timer = threading.Timer(STATUS_DELAY_S, start)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+            with lock:
+                state["done"] = True
+                if state["started"]:
+                    status.stop()
+
+    def _handle_bash_exec(
+        self,
+        args: Dict[str, Any],
+        show_status: bool = True,
+        approved: Optional[bool] = None,
+    ) -> Dict[str, Any]:
         command = args.get("command", "")
         timeout_s = int(args.get("timeout_s", 30))
         logger.info(f"bash_exec 工具被调用: {command[:100]}{'...' if len(command) > 100 else ''}")
 
-        if is_obviously_dangerous(command):
+        blocked_reason = check_command(command, self.config.work_dir)
+        if blocked_reason == "dangerous":
             logger.warning(f"bash_exec: 危险命令被拦截 - {command[:50]}")
-            return {
-                "ok": False,
-                "ran": False,
-                "reason": "dangerous_command_blocked",
-                "stdout": "",
-                "stderr": "blocked by guard",
-                "exit_code": 1,
-            }
+            return _not_run_payload("dangerous_command_blocked", "blocked by guard")
 
-        if is_outside_workdir(command, self.config.work_dir):
+        if blocked_reason == "path_outside":
             logger.warning(f"bash_exec: 路径越界被拦截 - {command[:50]}")
-            return {
-                "ok": False,
-                "ran": False,
-                "reason": "outside_workdir_blocked",
-                "stdout": "",
-                "stderr": f"must stay inside {self.config.work_dir}",
-                "exit_code": 1,
-            }
+            return _not_run_payload("outside_workdir_blocked", f"must stay inside {self.config.work_dir}")
+
+        if blocked_reason == "empty":
+            return _not_run_payload("empty", "empty command")
 
-        if not self.confirm(command):
+        if approved is None:
+            approved = self.confirm(command)
+        if not approved:
             logger.info("bash_exec: 用户取消了命令执行")
             self.console.print("[bold yellow]⏸️  用户取消了命令执行[/bold yellow]")
-            declined = BashResult("", "user declined", 1, ran=False, reason="declined")
-            return {
-                "ok": False,
-                "ran": declined.ran,
-                "reason": declined.reason,
-                "stdout": declined.stdout,
-                "stderr": declined.stderr,
-                "exit_code": declined.exit_code,
-            }
+            return _not_run_payload("declined", "user declined")
+
+        # 顺序执行时按行实时显示命令输出；并行执行时各命令输出会交错，改为结束后统一打印
+        streamed = False
+        partial_lines = {False: "", True: ""}
 
-        with Status("[bold blue]执行命令中...", spinner="dots"):
+        def show_output(text: str, is_stderr: bool) -> None:
+            nonlocal streamed
+            streamed = True
+            lines = (partial_lines[is_stderr] + text).split("\n")
+            partial_lines[is_stderr] = lines.pop()
+            for line in lines:
+                self.console.out(line, style="red" if is_stderr else None, highlight=False)
+
+        if show_status:
+            with self._delayed_status("[bold blue]执行命令中..."):
+                result = run_bash(command, self.config, timeout_s=timeout_s, on_output=show_output)
+            for is_stderr, line in partial_lines.items():
+                if line:
+                    self.console.out(line, style="red" if is_stderr else None, highlight=False)
+        else:
             result = run_bash(command, self.config, timeout_s=timeout_s)
 
+        # 合并为一次渲染；命令输出用 Text 包装，不做 markup 解析（输出中的 "[...]" 会被误当作样式标签）
         if result.exit_code == 0 and result.ran:
-            self.console.print("[bold green]✅ 命令执行成功[/bold green]")
+            parts = [Text("✅ 命令执行成功", style="bold green")]
         else:
-            self.console.print("[bold red]❌ 命令执行失败[/bold red]")
-
-        if result.stdout:
-            self.console.print(f"[cyan]输出:[/cyan] {result.stdout}")
-        if result.stderr:
-            self.console.print(f"[red]错误:[/red] {result.stderr}")
+            parts = [Text("❌ 命令执行失败", style="bold red")]
+        if not streamed:
+            if result.stdout:
+                parts.append(Text.assemble(("输出:", "cyan"), " ", result.stdout))
+            if result.stderr:
+                parts.append(Text.assemble(("错误:", "red"), " ", result.stderr))
         if result.reason:
-            self.console.print(f"[yellow]原因:[/yellow] {result.reason}")
+            parts.append(Text.assemble(("原因:", "yellow"), " ", result.reason))
+        self.console.print(Group(*parts))
 
         return {
             "ok": result.exit_code == 0 and result.ran,
             "ran": result.ran,
             "reason": result.reason,
-            "stdout": result.stdout,
-            "stderr": result.stderr,
+            "stdout": truncate_output(result.stdout),
+            "stderr": truncate_output(result.stderr),
             "exit_code": result.exit_code,
         }
 
-    def _handle_mcp_tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    def _handle_mcp_tool(self, name: str, args: Dict[str, Any], show_status: bool = True) -> Dict[str, Any]:
         logger.info(f"MCP 工具被调用: {name}")
         if not self.mcp_manager or not self.mcp_manager.is_connected():
             logger.error("MCP 工具调用失败: 客户端未连接")
             return {"ok": False, "error": "MCP 客户端未连接"}
 
-        parts = name[4:].split("_", 1)
-        if len(parts) == 2:
-            server_name, tool_name = parts
-            logger.debug(f"MCP 工具详情: 服务器={server_name}, 工具={tool_name}")
+        resolved = self.mcp_manager.resolve(name)
+        if resolved:
+            server_name, tool_name = resolved
+            logger.debug("MCP 工具详情: 服务器=%s, 工具=%s", server_name, tool_name)
             self.console.print(f"[bold blue]🔧 调用 MCP 工具: [{server_name}] {tool_name}[/bold blue]")
         else:
             self.console.print(f"[bold blue]🔧 调用 MCP 工具: {name}[/bold blue]")
 
-        with Status("[bold blue]执行 MCP 工具...", spinner="dots"):
-            result = self.mcp_manager.call_tool(name, args)
+        # MCP 工具可能改写工作目录中的文件，前后都让只读命令的结果缓存失效
+        invalidate_result_cache()
+        try:
+            if show_status:
+                with self._delayed_status("[bold blue]执行 MCP 工具..."):
+                    result = self.mcp_manager.call_tool(name, args)
+            else:
+                result = self.mcp_manager.call_tool(name, args)
+        finally:
+            invalidate_result_cache()
 
         if result.get("success"):
             logger.info(f"MCP 工具执行成功: {name}")
             self.console.print("[bold green]✅ MCP 工具执行成功[/bold green]")
             return {
                 "ok": True,
-                "content": result.get("content", []),
+                "content": [self._truncate_mcp_item(item) for item in result.get("content", [])],
                 "is_error": result.get("is_error", False),
             }
 
@@ -187,3 +351,12 @@ class ToolHandler:
         self.console.print("[bold red]❌ MCP 工具执行失败[/bold red]")
         self.console.print(f"[red]错误:[/red] {result.get('error', 'Unknown error')}")
         return {"ok": False, "error": result.get("error", "Unknown error")}
+
+    @staticmethod
+    def _truncate_mcp_item(item: Dict[str, Any]) -> Dict[str, Any]:
+        # MCP 工具（例如抓取网页、读取文档）可能返回很长的文本，与 bash 输出同样截断
+        for field in ("text", "data"):
+            value = item.get(field)
+            if isinstance(value, str) and len(value) > MAX_TOOL_OUTPUT_CHARS:
+                return {**item, field: truncate_output(value)}
+        return item
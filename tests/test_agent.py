@@ -0,0 +1,170 @@
+import logging
+from types import SimpleNamespace
+
+from rich.console import Console
+
+from src.agent import Agent, _get_encoding, output_limit_kwargs, parse_batch_answers
+from src.llm_cache import LLMCache
+
+
+def make_agent():
+    agent = object.__new__(Agent)
+    agent.logger = logging.getLogger("test-agent")
+    agent.echo_responses = True
+    agent.token_stats = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "api_calls": 0, "compressions": 0}
+    return agent
+
+
+def make_chunk(content=None, tool_calls=None, usage=None, finish_reason=None):
+    choices = []
+    if content is not None or tool_calls is not None or finish_reason is not None:
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        choices = [SimpleNamespace(delta=delta, finish_reason=finish_reason)]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def make_tool_delta(index, id=None, name=None, arguments=None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def test_consume_stream_assembles_content_and_tool_calls():
+    agent = make_agent()
+    stream = [
+        make_chunk(content="hel"),
+        make_chunk(content="lo"),
+        make_chunk(tool_calls=[make_tool_delta(0, id="call-1", name="bash_exec", arguments='{"comm')]),
+        make_chunk(tool_calls=[make_tool_delta(1, id="call-2", name="bash_exec", arguments="{}")]),
+        make_chunk(tool_calls=[make_tool_delta(0, arguments='and": "ls"}')]),
+        make_chunk(usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2, total_tokens=5)),
+    ]
+
+    content, tool_calls, serialized, truncated = agent._consume_stream(stream)
+
+    assert content == "hello"
+    assert truncated is False
+    assert [tc.id for tc in tool_calls] == ["call-1", "call-2"]
+    assert tool_calls[0].function.arguments == '{"command": "ls"}'
+    assert serialized[0] == {
+        "id": "call-1",
+        "type": "function",
+        "function": {"name": "bash_exec", "arguments": '{"command": "ls"}'},
+    }
+    assert agent.token_stats["total_tokens"] == 5
+    assert agent.token_stats["api_calls"] == 1
+
+
+def make_cached_agent(tmp_path, chunks):
+    agent = make_agent()
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return chunks + [make_chunk(usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2, total_tokens=5))]
+
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    agent.config = SimpleNamespace(openai_model="gpt-test", model_temperature=0.2, max_output_tokens=256)
+    agent.tool_handler = SimpleNamespace(get_tools=lambda: [])
+    agent.message_manager = SimpleNamespace(load_system_template=lambda: "system ${NOW_ISO}")
+    agent.llm_cache = LLMCache(tmp_path, ttl_s=60)
+    agent.messages = [{"role": "system", "content": "system 2024-01-01T00:00:00Z"}, {"role": "user", "content": "hi"}]
+    return agent, calls
+
+
+def test_call_model_replays_cached_response(tmp_path):
+    agent, calls = make_cached_agent(tmp_path, [make_chunk(content="hello")])
+
+    first = agent._call_model()
+    agent.messages[0] = {"role": "system", "content": "system 2024-01-01T00:00:09Z"}
+    second = agent._call_model()
+
+    assert len(calls) == 1
+    assert second[0] == first[0] == "hello"
+
+
+def test_call_model_does_not_cache_tool_calls(tmp_path):
+    tool_delta = make_tool_delta(0, id="call-1", name="bash_exec", arguments='{"command": "ls"}')
+    agent, calls = make_cached_agent(tmp_path, [make_chunk(tool_calls=[tool_delta])])
+
+    agent._call_model()
+    second = agent._call_model()
+
+    assert len(calls) == 2
+    assert second[1][0].function.arguments == '{"command": "ls"}'
+
+
+def test_truncated_response_is_not_run_or_cached(tmp_path):
+    agent = make_agent()
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return [
+            make_chunk(tool_calls=[make_tool_delta(0, id="call-1", name="bash_exec", arguments='{"command": "cat > a')]),
+            make_chunk(finish_reason="length"),
+        ]
+
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    agent.config = SimpleNamespace(openai_model="gpt-test", model_temperature=0.2, max_output_tokens=16)
+    agent.tool_handler = SimpleNamespace(get_tools=lambda: [], handle_tool_calls=lambda *args: calls.append("ran"))
+    agent.message_manager = SimpleNamespace(load_system_template=lambda: "system", compress_if_needed=lambda msgs: msgs)
+    agent.llm_cache = LLMCache(tmp_path, ttl_s=60)
+    agent.console = Console(record=True)
+    agent.messages = [{"role": "system", "content": "system"}]
+
+    agent._handle_user_turn("write a file")
+    agent._call_model()
+
+    assert "ran" not in calls
+    assert len(calls) == 2
+    assert calls[0]["max_tokens"] == 16
+    assert agent.messages[-1]["role"] == "user"
+    assert "截断" in agent.messages[-1]["content"]
+
+
+def test_output_limit_kwargs_uses_family_parameter():
+    assert output_limit_kwargs("gpt-4o-mini", None) == {}
+    assert output_limit_kwargs("gpt-4o-mini", 512) == {"max_tokens": 512}
+    assert output_limit_kwargs("openai/o3-mini", 512) == {"max_completion_tokens": 512}
+    assert output_limit_kwargs("gpt-5", 512) == {"max_completion_tokens": 512}
+
+
+def test_batch_mode_renders_answers_without_streaming_echo(tmp_path, monkeypatch):
+    agent = make_agent()
+    agent.console = Console(record=True)
+    printed, rendered = [], []
+    monkeypatch.setattr("src.agent.print_agent_delta", printed.append)
+    monkeypatch.setattr("src.agent.render_single_query_panel", lambda text: None)
+    monkeypatch.setattr("src.agent.render_batch_answers", lambda questions, answers: rendered.append(answers))
+    agent._handle_user_turn = lambda prompt: agent._consume_stream([make_chunk(content='["a", "b"]')])[0]
+    questions = tmp_path / "questions.txt"
+    questions.write_text("q1\nq2\n", encoding="utf-8")
+
+    agent._run_batch(questions)
+
+    assert printed == []
+    assert rendered == [["a", "b"]]
+    assert agent.echo_responses is True
+
+
+def test_parse_batch_answers_extracts_json_array():
+    assert parse_batch_answers('```json\n["a", "b"]\n```', 2) == ["a", "b"]
+    assert parse_batch_answers('["a", {"k": 1}]', 2) == ["a", '{"k":1}']
+    assert parse_batch_answers('["a"]', 2) is None
+    assert parse_batch_answers("not json", 1) is None
+
+
+def test_get_encoding_infers_family_for_unknown_models(monkeypatch):
+    def encoding_for_model(name):
+        if name == "gpt-4o-mini":
+            return "gpt-4o-mini-encoding"
+        raise KeyError(name)
+
+    monkeypatch.setattr("src.agent.tiktoken.encoding_for_model", encoding_for_model)
+    monkeypatch.setattr("src.agent.tiktoken.get_encoding", lambda name: name)
+    _get_encoding.cache_clear()
+    try:
+        assert _get_encoding("openai/gpt-4o-mini") == "gpt-4o-mini-encoding"
+        assert _get_encoding("gpt-5.9-next") == "o200k_base"
+        assert _get_encoding("my-local-model") == "cl100k_base"
+    finally:
+        _get_encoding.cache_clear()
@@ -16,6 +16,10 @@ def test_load_config_reads_environment(monkeypatch, tmp_path):
         "MCP_CONFIG_PATH": str(mcp_config),
         "MAX_CONTEXT_TOKENS": "4096",
         "KEEP_RECENT_MESSAGES": "7",
+        "MAX_OUTPUT_TOKENS": "512",
+        "REQUEST_TIMEOUT_S": "15",
+        "MAX_RETRIES": "1",
+        "LLM_CACHE_TTL_S": "600",
     }
 
     for key, value in env.items():
@@ -33,5 +37,9 @@ def test_load_config_reads_environment(monkeypatch, tmp_path):
     assert config.mcp_config_path == mcp_config.resolve()
     assert config.max_context_tokens == 4096
     assert config.keep_recent_messages == 7
+    assert config.max_output_tokens == 512
+    assert config.request_timeout_s == 15.0
+    assert config.max_retries == 1
+    assert config.llm_cache_ttl_s == 600.0
     assert config.project_root.is_dir()
     assert config.shell_type in {"bash", "cmd"}
@@ -0,0 +1,52 @@
+import os
+import time
+
+from src.llm_cache import LLMCache
+
+
+def make_key(cache, temperature=0.2, content="hi"):
+    return cache.make_key("gpt-test", [{"role": "user", "content": content}], [], temperature, 1024)
+
+
+def test_make_key_skips_disabled_cache_and_high_temperature(tmp_path):
+    assert make_key(LLMCache(tmp_path, ttl_s=0)) is None
+    assert make_key(LLMCache(tmp_path, ttl_s=60), temperature=0.9) is None
+
+    cache = LLMCache(tmp_path, ttl_s=60)
+    assert make_key(cache) == make_key(cache)
+    assert make_key(cache) != make_key(cache, content="other")
+
+
+def test_cache_round_trips_through_disk(tmp_path):
+    cache = LLMCache(tmp_path, ttl_s=60)
+    key = make_key(cache)
+    response = {"content": "hello", "tool_calls": []}
+    cache.set(key, response)
+
+    assert cache.get(key) == response
+    assert LLMCache(tmp_path, ttl_s=60).get(key) == response
+
+
+def test_cache_expires_entries(tmp_path):
+    cache = LLMCache(tmp_path, ttl_s=60)
+    key = make_key(cache)
+    cache.set(key, {"content": "stale", "tool_calls": []})
+    cache._entries[key]["expires_at"] = 0
+
+    assert cache.get(key) is None
+    assert not (tmp_path / f"{key}.json").exists()
+
+
+def test_first_write_prunes_expired_files(tmp_path):
+    stale = tmp_path / "stale.json"
+    stale.write_text("{}", encoding="utf-8")
+    old = time.time() - 120
+    os.utime(stale, (old, old))
+    fresh = tmp_path / "fresh.json"
+    fresh.write_text("{}", encoding="utf-8")
+
+    cache = LLMCache(tmp_path, ttl_s=60)
+    cache.set(make_key(cache), {"content": "hello", "tool_calls": []})
+
+    assert not stale.exists()
+    assert fresh.exists()
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.mcp_client import MCPClient, MCPClientManager, MCPServerConnection
+
+
+def make_server(name, tool_names):
+    server = MCPServerConnection(name, {"command": "demo"})
+    server.available_tools = [
+        {"name": tool_name, "description": f"{tool_name} tool", "input_schema": {"type": "object"}}
+        for tool_name in tool_names
+    ]
+    return server
+
+
+def test_get_all_tools_for_openai_is_cached():
+    client = MCPClient()
+    client.servers["demo"] = make_server("demo", ["read", "write"])
+
+    tools = client.get_all_tools_for_openai()
+    assert [tool["function"]["name"] for tool in tools] == ["mcp_demo_read", "mcp_demo_write"]
+    assert client.get_all_tools_for_openai() is tools
+
+
+def test_resolve_tool_name_handles_underscores_in_server_name():
+    client = MCPClient()
+    client.servers["my_docs"] = make_server("my_docs", ["read_file"])
+
+    assert client.resolve_tool_name("mcp_my_docs_read_file") == ("my_docs", "read_file")
+    assert client.resolve_tool_name("mcp_my_docs_missing") is None
+
+    result = asyncio.run(client.call_tool("mcp_unknown_tool", {}))
+    assert result["success"] is False
+
+
+def test_manager_runs_concurrent_calls_on_background_loop():
+    manager = MCPClientManager()
+    in_flight = []
+    loop_threads = set()
+
+    async def call_tool(tool_name, arguments):
+        loop_threads.add(threading.current_thread().name)
+        in_flight.append(tool_name)
+        await asyncio.sleep(0.05)
+        return {"success": True, "content": [], "peak": len(in_flight)}
+
+    async def connect_from_config(config):
+        return 1
+
+    async def cleanup():
+        return None
+
+    manager.client.call_tool = call_tool
+    manager.client.connect_from_config = connect_from_config
+    manager.client.cleanup = cleanup
+
+    assert manager.connect_from_config_dict({"mcpServers": {}})
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results = list(pool.map(lambda name: manager.call_tool(name, {}), ["a", "b", "c"]))
+
+    assert loop_threads == {"mcp-event-loop"}
+    assert max(result["peak"] for result in results) == 3
+    manager.cleanup()
+    assert manager.loop is None
+
+
+def test_connect_from_config_connects_servers_concurrently(monkeypatch):
+    active = []
+    peak = []
+
+    async def fake_connect(self, exit_stack):
+        active.append(self.name)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(self.name)
+        return self.name != "broken"
+
+    monkeypatch.setattr(MCPServerConnection, "connect", fake_connect)
+    client = MCPClient()
+    config = {"mcpServers": {name: {"command": "demo"} for name in ("a", "broken", "c")}}
+
+    assert asyncio.run(client.connect_from_config(config)) == 2
+    assert list(client.servers) == ["a", "c"]
+    assert max(peak) == 3
@@ -7,9 +7,9 @@ from src.message_manager import MessageManager
 
 
 class FakeEncoding:
-    def encode(self, text: str) -> list[int]:
-        text = text or ""
-        return list(range(len(text)))
+    def encode(self, text: str) -> range:
+        # 调用方只取 len()，range 无需分配整数列表
+        return range(len(text or ""))
 
 
 class FakeClient:
@@ -66,6 +66,18 @@ def test_count_message_tokens(tmp_path):
     assert manager.count_message_tokens(messages) == 12
 
 
+def test_count_message_tokens_caches_text(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path)
+    calls = []
+    encode = manager.encoding.encode
+    monkeypatch.setattr(manager.encoding, "encode", lambda text: calls.append(text) or encode(text))
+
+    messages = [{"role": "user", "content": "hello world"}]
+    first = manager.count_message_tokens(messages)
+    assert manager.count_message_tokens(messages) == first
+    assert calls == ["hello world", "user"]
+
+
 def test_find_safe_split_keeps_tool_pairs(tmp_path):
     manager = make_manager(tmp_path, keep_recent=1)
     messages = [
@@ -100,6 +112,25 @@ def test_compress_if_needed_triggers_force(tmp_path, monkeypatch):
     assert captured["force"] is True
 
 
+def test_compress_if_needed_counts_only_appended_messages(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path, max_tokens=10_000)
+    messages = [{"role": "system", "content": "sys"}, {"role": "user", "content": "hi"}]
+    counted = []
+    count = manager.count_message_tokens
+    monkeypatch.setattr(manager, "count_message_tokens", lambda msgs: counted.append(len(msgs)) or count(msgs))
+
+    manager.compress_if_needed(messages)
+    messages.append({"role": "assistant", "content": "hello"})
+    manager.compress_if_needed(messages)
+    manager.compress_if_needed(messages)
+
+    assert counted == [2, 1]
+    assert manager._count_history_tokens(messages) == count(messages)
+
+    manager.compress_if_needed([{"role": "system", "content": "sys"}])
+    assert counted[-1] == 1
+
+
 def test_manual_compress_uses_do_compress(tmp_path, monkeypatch):
     manager = make_manager(tmp_path)
     messages = [{"role": "user", "content": "hi"}]
@@ -121,3 +152,29 @@ def test_serialize_tool_calls(tmp_path):
     serialized = manager.serialize_tool_calls(tool_calls)
     assert serialized[0]["id"] == "call-1"
     assert serialized[0]["function"]["name"] == "bash_exec"
+
+
+def test_load_system_reads_template_once(tmp_path):
+    manager = make_manager(tmp_path)
+    first = manager.load_system()
+    (tmp_path / "proj" / "prompts" / "system.md").unlink()
+
+    second = manager.load_system()
+    assert second["content"].split()[:2] == ["system", str(manager.config.work_dir)]
+    assert first["content"].endswith("Linux bash")
+
+
+def test_trim_recent_messages_drops_oldest_tool_groups(tmp_path):
+    manager = make_manager(tmp_path)
+    messages = [
+        {"role": "user", "content": "x" * 40},
+        {"role": "assistant", "content": "", "tool_calls": [{"function": {"name": "a", "arguments": "{}"}}]},
+        {"role": "tool", "name": "a", "content": "y" * 40},
+        {"role": "user", "content": "latest"},
+    ]
+
+    trimmed = manager._trim_recent_messages(messages, budget=30)
+    assert trimmed == messages[3:]
+
+    trimmed = manager._trim_recent_messages(messages, budget=manager.count_message_tokens(messages[1:]))
+    assert trimmed == messages[1:]
@@ -1,7 +1,16 @@
 from pathlib import Path
+from types import SimpleNamespace
 
+from src import security
 from src.config import Config
-from src.security import is_obviously_dangerous, is_outside_workdir, run_bash
+from src.security import (
+    check_command,
+    invalidate_result_cache,
+    is_obviously_dangerous,
+    is_outside_workdir,
+    is_read_only_command,
+    run_bash,
+)
 
 
 def make_config(tmp_path: Path) -> Config:
@@ -31,12 +40,57 @@ def test_is_obviously_dangerous_identifies_risky_commands():
     assert not is_obviously_dangerous("echo 'hello world'")
 
 
+def test_is_obviously_dangerous_ignores_case():
+    assert is_obviously_dangerous("SUDO ls")
+    assert is_obviously_dangerous("cat /ETC/hosts")
+    assert is_obviously_dangerous("Chmod 777 -r .")
+
+
+def test_is_obviously_dangerous_handles_multiline_commands():
+    assert is_obviously_dangerous("cat\n/etc/passwd")
+    assert is_obviously_dangerous("ls\t/root")
+    assert is_obviously_dangerous("echo ok\nsudo ls")
+    assert not is_obviously_dangerous("cat ./etc/notes.txt")
+
+
 def test_is_outside_workdir_flags_absolute_and_parent_paths(tmp_path):
     work_dir = tmp_path / "sandbox"
     work_dir.mkdir()
     assert is_outside_workdir("/etc/passwd", work_dir)
     assert is_outside_workdir("../secret.txt", work_dir)
     assert not is_outside_workdir("safe.txt", work_dir)
+    assert is_outside_workdir("ls ..", work_dir)
+    assert not is_outside_workdir("grep -rn todo .", work_dir)
+    assert not is_outside_workdir("sed 's/a/b/' notes.txt", work_dir)
+    assert not is_outside_workdir("cat src/..hidden", work_dir)
+    assert is_outside_workdir("cat src/../../x", work_dir)
+    assert is_outside_workdir("tar --file=/tmp/x.tar .", work_dir)
+    assert is_outside_workdir("cd ..&&ls", work_dir)
+    assert is_outside_workdir('cat "/etc/hosts"', work_dir)
+
+
+def test_is_outside_workdir_sees_through_backslash_escapes(tmp_path):
+    work_dir = tmp_path / "sandbox"
+    work_dir.mkdir()
+    assert is_outside_workdir("cat \\/etc/passwd", work_dir)
+    assert is_outside_workdir("ls \\..", work_dir)
+    assert is_outside_workdir("ls \\.\\.", work_dir)
+    assert not is_outside_workdir("printf 'a\\tb'", work_dir)
+
+
+def test_is_outside_workdir_skips_scan_without_path_hints(tmp_path, monkeypatch):
+    class FailingPattern:
+        def search(self, command):
+            raise AssertionError("regex should not run")
+
+    monkeypatch.setattr("src.security._OUTSIDE_PATH_RE", FailingPattern())
+    assert not is_outside_workdir("ls -la", tmp_path)
+
+
+def test_run_bash_blocks_escaped_absolute_path(tmp_path):
+    result = run_bash("head -1 \\/etc/passwd", make_config(tmp_path))
+    assert result.ran is False
+    assert result.reason == "path_outside"
 
 
 def test_run_bash_blocks_outside_paths(tmp_path):
@@ -52,3 +106,74 @@ def test_run_bash_executes_safe_command(tmp_path):
     assert result.exit_code == 0
     assert result.ran is True
     assert "hello" in result.stdout.strip()
+
+
+def test_check_command_reports_reason_once_per_command(tmp_path, monkeypatch):
+    work_dir = tmp_path / "sandbox"
+    assert check_command("   ", work_dir) == "empty"
+    assert check_command("cat ../secret", work_dir) == "path_outside"
+    assert check_command("sudo ls", work_dir) == "dangerous"
+    assert check_command("sudo rm -rf /", work_dir) == "dangerous"
+    assert check_command("sudo cat /etc/x", work_dir) == "dangerous"
+    assert check_command("ls -la", work_dir) == ""
+
+    calls = []
+    monkeypatch.setattr("src.security.is_outside_workdir", lambda command, work_dir: calls.append(command) or False)
+    check_command("echo cached-check", work_dir)
+    check_command("echo cached-check", work_dir)
+    assert calls == ["echo cached-check"]
+
+
+def test_check_command_logs_every_blocked_attempt(tmp_path, monkeypatch):
+    logged = []
+    fake_logger = SimpleNamespace(warning=logged.append, error=logged.append)
+    monkeypatch.setattr("src.security.logger", fake_logger)
+    work_dir = tmp_path / "sandbox"
+
+    check_command("sudo rm -rf /tmp/x", work_dir)
+    check_command("sudo rm -rf /tmp/x", work_dir)
+    check_command("cat ../audit", work_dir)
+    check_command("cat ../audit", work_dir)
+
+    assert sum("命令被安全检查拦截" in message for message in logged) == 2
+    assert sum("工作目录外" in message for message in logged) == 2
+
+
+def test_is_read_only_command():
+    assert is_read_only_command("ls -la")
+    assert is_read_only_command("git status")
+    assert not is_read_only_command("cat a.txt > b.txt")
+    assert not is_read_only_command("ls; touch x")
+    assert not is_read_only_command("lsof")
+    assert not is_read_only_command("echo hi")
+
+
+def test_run_bash_cache_returns_fresh_output_after_external_edit(tmp_path):
+    config = make_config(tmp_path)
+    target = config.work_dir / "notes.txt"
+    target.write_text("v1", encoding="utf-8")
+
+    assert run_bash("cat notes.txt", config).stdout == "v1"
+    target.write_text("v2!", encoding="utf-8")
+    assert run_bash("cat notes.txt", config).stdout == "v2!"
+
+    run_bash("echo v3 > notes.txt", config)
+    assert run_bash("cat notes.txt", config).stdout == "v3\n"
+
+
+def test_run_bash_reuses_cached_read_while_file_is_unchanged(tmp_path, monkeypatch):
+    config = make_config(tmp_path)
+    (config.work_dir / "notes.txt").write_text("v1", encoding="utf-8")
+    calls = []
+    execute = security._execute
+    monkeypatch.setattr("src.security._execute", lambda *args: calls.append(args[0]) or execute(*args))
+
+    run_bash("cat notes.txt", config)
+    run_bash("cat notes.txt", config)
+    run_bash("ls", config)
+    run_bash("ls", config)
+    assert calls == ["cat notes.txt", "ls", "ls"]
+
+    invalidate_result_cache()
+    run_bash("cat notes.txt", config)
+    assert calls[-1] == "cat notes.txt" and len(calls) == 4
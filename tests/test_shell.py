@@ -0,0 +1,102 @@
+import subprocess
+
+import pytest
+
+from src.shell import ShellPool, ShellSession, _BoundedCapture
+
+
+def test_shell_session_separates_streams_and_exit_code(tmp_path):
+    session = ShellSession(tmp_path)
+    try:
+        stdout, stderr, exit_code = session.run("printf out; printf err >&2; exit 3", timeout_s=5)
+        assert (stdout, stderr, exit_code) == (b"out", b"err", 3)
+
+        stdout, _, exit_code = session.run("pwd", timeout_s=5)
+        assert exit_code == 0
+        assert stdout.decode().strip() == str(tmp_path)
+    finally:
+        session.close()
+
+
+def test_shell_session_does_not_leak_state_between_commands(tmp_path):
+    (tmp_path / "sub").mkdir()
+    session = ShellSession(tmp_path)
+    try:
+        session.run("cd sub; export LEAK=1", timeout_s=5)
+        stdout, _, _ = session.run('pwd; echo "${LEAK:-unset}"', timeout_s=5)
+        assert stdout.decode().split() == [str(tmp_path), "unset"]
+    finally:
+        session.close()
+
+
+def test_shell_session_reports_syntax_errors(tmp_path):
+    session = ShellSession(tmp_path)
+    try:
+        _, stderr, exit_code = session.run("echo 'unterminated", timeout_s=5)
+        assert exit_code != 0
+        assert stderr
+        assert session.is_alive()
+    finally:
+        session.close()
+
+
+def test_shell_pool_replaces_session_after_timeout(tmp_path):
+    pool = ShellPool(tmp_path)
+    try:
+        with pytest.raises(subprocess.TimeoutExpired):
+            pool.run("sleep 5", timeout_s=0.2)
+        stdout, _, exit_code = pool.run("echo again", timeout_s=5)
+        assert (stdout, exit_code) == (b"again\n", 0)
+    finally:
+        pool.close()
+
+
+def test_bounded_capture_keeps_head_and_tail():
+    capture = _BoundedCapture(limit=8)
+    for piece in (b"ab", b"cdef", b"ghij", b"kl"):
+        capture.append(piece)
+    assert capture.getvalue() == "abcd\n...[省略 4 字节]...\nijkl".encode()
+
+    small = _BoundedCapture(limit=8)
+    small.append(b"abc")
+    assert small.getvalue() == b"abc"
+
+
+def test_shell_session_handles_large_output(tmp_path):
+    session = ShellSession(tmp_path)
+    try:
+        stdout, _, exit_code = session.run("head -c 300000 /dev/zero | tr '\\0' x", timeout_s=10)
+        assert exit_code == 0
+        assert stdout == b"x" * 300000
+    finally:
+        session.close()
+
+
+def test_shell_session_reports_output_as_it_arrives(tmp_path):
+    session = ShellSession(tmp_path)
+    received = []
+    try:
+        stdout, stderr, _ = session.run(
+            "echo first; echo oops >&2; sleep 0.2; echo second",
+            timeout_s=5,
+            on_output=lambda data, is_stderr: received.append((data, is_stderr)),
+        )
+    finally:
+        session.close()
+
+    assert received[0] == (b"first\n", False)
+    assert b"".join(data for data, is_stderr in received if not is_stderr) == stdout == b"first\nsecond\n"
+    assert b"".join(data for data, is_stderr in received if is_stderr) == stderr == b"oops\n"
+
+
+def test_shell_session_drops_output_of_background_jobs(tmp_path):
+    session = ShellSession(tmp_path)
+    try:
+        stdout, _, exit_code = session.run("(sleep 0.3; echo late) & echo started", timeout_s=5)
+        assert (stdout, exit_code) == (b"started\n", 0)
+
+        stdout, _, exit_code = session.run("echo next; sleep 0.5; echo done", timeout_s=5)
+        assert (stdout, exit_code) == (b"next\ndone\n", 0)
+        assert session.is_alive()
+    finally:
+        session.close()
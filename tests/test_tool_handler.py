@@ -1,11 +1,15 @@
 import json
+import os
+import threading
+import time
+from dataclasses import replace
 from types import SimpleNamespace
 
 from rich.console import Console
 
 from src.config import Config
 from src.security import BashResult
-from src.tool_handler import ToolHandler
+from src.tool_handler import ToolHandler, truncate_output
 
 
 def make_config(tmp_path):
@@ -28,6 +32,10 @@ def make_config(tmp_path):
     )
 
 
+def make_tool_call(call_id, name, arguments="{}"):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
 def test_tool_handler_runs_bash_exec(monkeypatch, tmp_path):
     config = make_config(tmp_path)
     console = Console(record=True)
@@ -35,15 +43,12 @@ def test_tool_handler_runs_bash_exec(monkeypatch, tmp_path):
     result = BashResult(stdout="done\n", stderr="", exit_code=0, ran=True, reason="")
     monkeypatch.setattr(
         "src.tool_handler.run_bash",
-        lambda command, config, timeout_s=30: result,
+        lambda command, config, timeout_s=30, on_output=None: result,
     )
 
     handler = ToolHandler(config, console, confirm=lambda _: True, mcp_manager=None)
     messages = []
-    tool_call = SimpleNamespace(
-        id="1",
-        function=SimpleNamespace(name="bash_exec", arguments=json.dumps({"command": "echo 1"})),
-    )
+    tool_call = make_tool_call("1", "bash_exec", json.dumps({"command": "echo 1"}))
 
     handler.handle_tool_calls(messages, [tool_call])
 
@@ -53,16 +58,34 @@ def test_tool_handler_runs_bash_exec(monkeypatch, tmp_path):
     assert payload["stdout"] == "done\n"
 
 
+def test_tool_handler_prints_bash_output_without_markup(monkeypatch, tmp_path):
+    config = replace(make_config(tmp_path), confirm_before_exec=False)
+    console = Console(record=True, width=80)
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_run_bash(command, config, timeout_s=30, on_output=None):
+        barrier.wait()
+        return BashResult(stdout="[bold]x[/] [/]\n", stderr="", exit_code=0, ran=True, reason="")
+
+    monkeypatch.setattr("src.tool_handler.run_bash", fake_run_bash)
+
+    handler = ToolHandler(config, console, confirm=lambda _: True, mcp_manager=None)
+    tool_calls = [
+        make_tool_call(str(i), "bash_exec", json.dumps({"command": "ls"}))
+        for i in range(2)
+    ]
+    handler.handle_tool_calls([], tool_calls)
+
+    assert "输出: [bold]x[/] [/]" in console.export_text()
+
+
 def test_tool_handler_reports_missing_mcp(tmp_path):
     config = make_config(tmp_path)
     console = Console(record=True)
     handler = ToolHandler(config, console, confirm=lambda _: True, mcp_manager=None)
 
     messages = []
-    tool_call = SimpleNamespace(
-        id="tool-1",
-        function=SimpleNamespace(name="mcp_server_tool", arguments="{}"),
-    )
+    tool_call = make_tool_call("tool-1", "mcp_server_tool", "{}")
 
     handler.handle_tool_calls(messages, [tool_call])
 
@@ -90,3 +113,191 @@ def test_tool_list_includes_mcp_tools_when_available(tmp_path):
 
     tools = handler.get_tools()
     assert any(tool["function"]["name"] == "mcp_demo_tool" for tool in tools if tool["type"] == "function")
+
+
+def test_tool_list_is_cached_until_invalidated(tmp_path):
+    class FakeMCP:
+        def __init__(self):
+            self.calls = 0
+
+        def is_connected(self):
+            return True
+
+        def get_tools_for_openai(self):
+            self.calls += 1
+            return []
+
+    mcp = FakeMCP()
+    handler = ToolHandler(make_config(tmp_path), Console(record=True), confirm=lambda _: True, mcp_manager=mcp)
+
+    assert handler.get_tools() is handler.get_tools()
+    assert mcp.calls == 1
+
+    handler.invalidate_tools()
+    handler.get_tools()
+    assert mcp.calls == 2
+
+
+def test_tool_handler_runs_read_only_bash_calls_in_parallel(monkeypatch, tmp_path):
+    config = replace(make_config(tmp_path), confirm_before_exec=False)
+    console = Console(record=True)
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_run_bash(command, config, timeout_s=30, on_output=None):
+        barrier.wait()
+        return BashResult(stdout=command, stderr="", exit_code=0, ran=True, reason="")
+
+    monkeypatch.setattr("src.tool_handler.run_bash", fake_run_bash)
+
+    handler = ToolHandler(config, console, confirm=lambda _: True, mcp_manager=None)
+    messages = []
+    tool_calls = [
+        make_tool_call(f"call-{i}", "bash_exec", json.dumps({"command": f"cat {i}.txt"}))
+        for i in range(2)
+    ]
+
+    handler.handle_tool_calls(messages, tool_calls)
+
+    assert [msg["tool_call_id"] for msg in messages] == ["call-0", "call-1"]
+    assert [json.loads(msg["content"])["stdout"] for msg in messages] == ["cat 0.txt", "cat 1.txt"]
+
+
+def test_tool_handler_confirms_parallel_batch_once_and_keeps_writes_ordered(monkeypatch, tmp_path):
+    config = make_config(tmp_path)
+    console = Console(record=True)
+    executed = []
+
+    def fake_run_bash(command, config, timeout_s=30, on_output=None):
+        executed.append(command)
+        return BashResult(stdout="", stderr="", exit_code=0, ran=True, reason="")
+
+    monkeypatch.setattr("src.tool_handler.run_bash", fake_run_bash)
+
+    single, batches = [], []
+    handler = ToolHandler(
+        config,
+        console,
+        confirm=lambda command: single.append(command) or True,
+        mcp_manager=None,
+        confirm_many=lambda commands: batches.append(commands) or True,
+    )
+    commands = ["ls", "cat a.txt", "touch b.txt", "cat b.txt"]
+    tool_calls = [
+        make_tool_call(str(i), "bash_exec", json.dumps({"command": cmd}))
+        for i, cmd in enumerate(commands)
+    ]
+
+    handler.handle_tool_calls([], tool_calls)
+
+    assert batches == [["ls", "cat a.txt"]]
+    assert single == ["touch b.txt", "cat b.txt"]
+    assert executed.index("touch b.txt") < executed.index("cat b.txt")
+
+
+def test_truncate_output_keeps_head_and_tail():
+    assert truncate_output("short", limit=10) == "short"
+
+    text = "a" * 10 + "b" * 10 + "c" * 10
+    truncated = truncate_output(text, limit=10)
+    assert truncated.startswith("aaaaa\n")
+    assert truncated.endswith("\nccccc")
+    assert "20" in truncated
+
+
+def test_tool_handler_streams_bash_output_to_console(monkeypatch, tmp_path):
+    config = make_config(tmp_path)
+    console = Console(record=True, width=80)
+
+    def fake_run_bash(command, config, timeout_s=30, on_output=None):
+        on_output("line 1\nline", False)
+        on_output(" 2", False)
+        return BashResult(stdout="line 1\nline 2", stderr="", exit_code=0, ran=True, reason="")
+
+    monkeypatch.setattr("src.tool_handler.run_bash", fake_run_bash)
+
+    handler = ToolHandler(config, console, confirm=lambda _: True, mcp_manager=None)
+    tool_call = make_tool_call("1", "bash_exec", json.dumps({"command": "make"}))
+    handler.handle_tool_calls([], [tool_call])
+
+    output = console.export_text()
+    assert "line 1\nline 2\n" in output
+    assert "输出:" not in output
+
+
+def test_tool_handler_truncates_long_mcp_text(tmp_path):
+    class FakeMCP:
+        def is_connected(self):
+            return True
+
+        def resolve(self, name):
+            return ("docs", "fetch")
+
+        def call_tool(self, name, args):
+            return {"success": True, "content": [{"type": "text", "text": "z" * 20000}], "is_error": False}
+
+    handler = ToolHandler(make_config(tmp_path), Console(record=True), confirm=lambda _: True, mcp_manager=FakeMCP())
+    messages = []
+    tool_call = make_tool_call("mcp-1", "mcp_docs_fetch", "{}")
+
+    handler.handle_tool_calls(messages, [tool_call])
+
+    payload = json.loads(messages[-1]["content"])
+    assert payload["ok"] is True
+    assert len(payload["content"][0]["text"]) < 20000
+
+
+def test_mcp_call_invalidates_cached_bash_reads(tmp_path):
+    config = make_config(tmp_path)
+    target = config.work_dir / "notes.txt"
+    target.write_text("v1", encoding="utf-8")
+
+    class FakeMCP:
+        def is_connected(self):
+            return True
+
+        def resolve(self, name):
+            return ("fs", "write")
+
+        def call_tool(self, name, args):
+            # 保持 mtime 和大小不变，只有显式失效才能让缓存看到新内容
+            stat = target.stat()
+            target.write_text("v2", encoding="utf-8")
+            os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            return {"success": True, "content": [], "is_error": False}
+
+    handler = ToolHandler(config, Console(record=True), confirm=lambda _: True, mcp_manager=FakeMCP())
+    messages = []
+    handler.handle_tool_calls(messages, [make_tool_call("1", "bash_exec", json.dumps({"command": "cat notes.txt"}))])
+    handler.handle_tool_calls(messages, [make_tool_call("2", "mcp_fs_write", "{}")])
+    handler.handle_tool_calls(messages, [make_tool_call("3", "bash_exec", json.dumps({"command": "cat notes.txt"}))])
+
+    assert json.loads(messages[0]["content"])["stdout"] == "v1"
+    assert json.loads(messages[-1]["content"])["stdout"] == "v2"
+
+
+def test_tool_handler_reports_invalid_arguments(tmp_path):
+    handler = ToolHandler(make_config(tmp_path), Console(record=True), confirm=lambda _: True, mcp_manager=None)
+    messages = []
+    tool_call = make_tool_call("bad", "bash_exec", '{"command": "ls"')
+
+    handler.handle_tool_calls(messages, [tool_call])
+
+    payload = json.loads(messages[-1]["content"])
+    assert payload["ok"] is False
+    assert "invalid arguments" in payload["error"]
+
+
+def test_status_only_shown_for_slow_tools(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr("src.tool_handler.Status.start", lambda self: started.append(self))
+    monkeypatch.setattr("src.tool_handler.Status.stop", lambda self: None)
+    monkeypatch.setattr("src.tool_handler.STATUS_DELAY_S", 0.05)
+    handler = ToolHandler(make_config(tmp_path), Console(record=True), confirm=lambda _: True)
+
+    with handler._delayed_status("fast"):
+        pass
+    assert started == []
+
+    with handler._delayed_status("slow"):
+        time.sleep(0.2)
+    assert len(started) == 1